@@ -0,0 +1,111 @@
+import math
+import threading
+import time
+
+import background_service_functions
+import cluster_cache
+import dispatch_counters
+
+# per-node and per-model concurrency limits with a bounded wait queue
+# a request whose expected completion on the chosen node would miss its latency budget
+# is redirected to a replica that can meet it, or rejected straight away when none can
+
+#seconds of queued work a replica may hold, the per-model limit is target_window / processing time
+target_window = 2.0
+#concurrent requests a node may serve across all models
+node_concurrency_limit = 8
+#overrides, {model : limit} or {(model, node_name) : limit} and {node_name : limit}
+model_limits = {}
+node_limits = {}
+#requests allowed to wait per (model, node) once its limit is reached
+max_queue = 16
+#client latency values are multiplied by this to get seconds (processing_time_table is in seconds)
+latency_unit_seconds = 1.0
+#processing time assumed for models or nodes missing from processing_time_table
+default_processing_time = 1.0
+
+condition = threading.Condition()
+active = {}
+node_active = {}
+waiting = {}
+admission_stats = {"admitted" : 0, "redirected" : 0, "rejected_budget" : 0, "rejected_queue_full" : 0, "timed_out" : 0}
+
+def get_processing_time(model, host_ip):
+    times = background_service_functions.processing_time_table.get(model, {})
+    return times.get(host_ip, default_processing_time)
+
+def get_model_limit(model, node_name, host_ip):
+    if (model, node_name) in model_limits:
+        return model_limits[(model, node_name)]
+    if model in model_limits:
+        return model_limits[model]
+    return max(1, int(target_window / get_processing_time(model, host_ip)))
+
+def get_node_limit(node_name):
+    return node_limits.get(node_name, node_concurrency_limit)
+
+# seconds until a new request would finish if load requests are already ahead of it
+def estimate_completion(model, node_name, host_ip, load):
+    rounds = math.floor(load / get_model_limit(model, node_name, host_ip))
+    return get_processing_time(model, host_ip) * (1 + rounds)
+
+# checks the chosen host of a dispatch against the latency budget, moving it to the
+# fastest other replica when it would miss, returns False when no replica can meet it
+def admit(model, candidate_ips, best_node, latency):
+    budget = float(latency) * latency_unit_seconds
+    estimates = {}
+    for host_ip in candidate_ips:
+        node_name = cluster_cache.get_node_name(host_ip)
+        estimates[host_ip] = (estimate_completion(model, node_name, host_ip, dispatch_counters.get_load(model, node_name)), node_name)
+    if best_node['host'] in estimates and estimates[best_node['host']][0] <= budget:
+        return True
+    fastest = min(estimates, key=lambda host_ip: estimates[host_ip][0])
+    with condition:
+        if estimates[fastest][0] > budget:
+            admission_stats["rejected_budget"] += 1
+            return False
+        admission_stats["redirected"] += 1
+    best_node['host'] = fastest
+    best_node['name'] = estimates[fastest][1]
+    return True
+
+def has_capacity(key, node_name, host_ip):
+    return active.get(key, 0) < get_model_limit(key[0], node_name, host_ip) and node_active.get(node_name, 0) < get_node_limit(node_name)
+
+# takes a concurrency slot for a proxied request, waiting in the bounded queue only while
+# the request can still meet its budget, returns False when it is rejected
+def acquire(model, node_name, host_ip, latency):
+    key = (model, node_name)
+    processing_time = get_processing_time(model, host_ip)
+    deadline = time.monotonic() + float(latency) * latency_unit_seconds - processing_time
+    with condition:
+        if not has_capacity(key, node_name, host_ip):
+            if waiting.get(key, 0) >= max_queue:
+                admission_stats["rejected_queue_full"] += 1
+                return False
+            if estimate_completion(model, node_name, host_ip, active.get(key, 0) + waiting.get(key, 0)) > float(latency) * latency_unit_seconds:
+                admission_stats["rejected_budget"] += 1
+                return False
+            waiting[key] = waiting.get(key, 0) + 1
+            admitted = condition.wait_for(lambda: has_capacity(key, node_name, host_ip), max(0, deadline - time.monotonic()))
+            waiting[key] -= 1
+            if not admitted:
+                admission_stats["timed_out"] += 1
+                return False
+        active[key] = active.get(key, 0) + 1
+        node_active[node_name] = node_active.get(node_name, 0) + 1
+        admission_stats["admitted"] += 1
+        return True
+
+def release(model, node_name):
+    with condition:
+        active[(model, node_name)] = max(0, active.get((model, node_name), 0) - 1)
+        node_active[node_name] = max(0, node_active.get(node_name, 0) - 1)
+        condition.notify_all()
+
+def get_admission_stats():
+    with condition:
+        stats = admission_stats.copy()
+        stats["active"] = {model + '/' + str(node) : count for (model, node), count in active.items() if count}
+        stats["waiting"] = {model + '/' + str(node) : count for (model, node), count in waiting.items() if count}
+    return stats
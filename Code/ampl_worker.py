@@ -0,0 +1,134 @@
+import atexit
+import io
+import queue
+import subprocess
+import threading
+
+import cluster_inventory
+
+# long-lived AMPL process fed over stdin, started once and reused for every solve
+# the model is loaded once with the request and server counts as parameters instead of a
+# hard-coded set size, each solve sends "reset data", the data section built in
+# memory and the solve command, and AMPL prints the placement back as
+# "RESULT i j value" lines ending with a marker line instead of solver_results.txt
+# variables keep their values between solves, so IPOPT starts from the last solution
+# a worker that exits or stops answering is killed and started again
+
+ampl_path = './ampl_files/ampl'
+model_template = 'ampl_files/template.mod'
+model_file = 'ampl_files/solver_worker.mod'
+#AMPL solver option
+worker_solver = 'ipopt'
+#seconds to wait for the results of one solve before restarting the worker
+solve_timeout = 300
+end_marker = 'END_OF_RESULTS'
+
+worker_lock = threading.Lock()
+process = None
+output_lines = None
+worker_stats = {"starts" : 0, "restarts" : 0, "solves" : 0, "failures" : 0}
+
+# the solver model with the request, model and server sets sized by params num_req and num_servers
+def build_worker_model():
+    with open(model_template, "r") as template, open(model_file, "w") as worker_model:
+        worker_model.write("param num_req integer >= 0;\nparam num_servers integer >= 1;\n")
+        for line in template:
+            if '<num_req>' in line:
+                worker_model.write("set request := {0..num_req};\n")
+            elif '<num_models>' in line:
+                worker_model.write("set mlmodel := {0..num_req};\n")
+            elif cluster_inventory.is_server_set_line(line):
+                worker_model.write("set server := {0..num_servers-1};\n")
+            else:
+                worker_model.write(line)
+
+def read_output(stdout, lines):
+    for line in stdout:
+        lines.put(line)
+    lines.put(None)
+
+def start_worker():
+    global process, output_lines
+    build_worker_model()
+    process = subprocess.Popen([ampl_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    output_lines = queue.Queue()
+    threading.Thread(target=read_output, args=(process.stdout, output_lines), name='ampl-worker-output', daemon=True).start()
+    send("model " + model_file + ";\noption solver " + worker_solver + ";\n")
+    if worker_stats["starts"] > 0:
+        worker_stats["restarts"] += 1
+    worker_stats["starts"] += 1
+
+def stop_worker():
+    global process
+    if process is not None:
+        try:
+            process.stdin.close()
+            process.wait(5)
+        except Exception:
+            process.kill()
+        process = None
+
+def send(commands):
+    process.stdin.write(commands)
+    process.stdin.flush()
+
+# result rows and solve_result of one solve, raises when the worker died or timed out
+def read_results(request_count, server_count):
+    results = [[0] * server_count for _ in range(request_count)]
+    solve_result = None
+    while True:
+        line = output_lines.get(timeout=solve_timeout)
+        if line is None:
+            raise RuntimeError('AMPL WORKER EXITED')
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0] == end_marker:
+            return results, solve_result
+        if fields[0] == 'SOLVE_RESULT' and len(fields) > 1:
+            solve_result = fields[1]
+        elif fields[0] == 'RESULT' and len(fields) == 4:
+            results[int(fields[1])][int(fields[2])] = int(fields[3])
+
+def solve_commands(request_stats, available_memory, build_data_file, server_count):
+    data = io.StringIO()
+    if not build_data_file(request_stats, available_memory, data):
+        raise RuntimeError('DATA GENERATION FAILED')
+    return ("reset data;\ndata;\nparam num_req := " + str(len(request_stats) - 1) + ";\nparam num_servers := " + str(server_count) + ";\n" + data.getvalue() + "\nmodel;\nsolve;\n" +
+    "printf \"SOLVE_RESULT %s\\n\", solve_result;\n" +
+    "printf {i in 0.." + str(len(request_stats) - 1) + ", j in 0.." + str(server_count - 1) + "}: \"RESULT %d %d %d\\n\", i, j, round(probability[i,j]);\n" +
+    "printf \"" + end_marker + "\\n\";\n")
+
+# solves with the persistent worker, starting it on first use and retrying once on a fresh worker if it fails
+def solve(request_stats, available_memory, build_data_file, server_count):
+    if len(request_stats) == 0:
+        #empty request log, e.g. a fresh cluster, num_req would be -1
+        return []
+    commands = solve_commands(request_stats, available_memory, build_data_file, server_count)
+    with worker_lock:
+        for _ in range(2):
+            try:
+                if process is not None and process.poll() is not None:
+                    print('AMPL WORKER EXITED, RESTARTING')
+                    stop_worker()
+                if process is None:
+                    start_worker()
+                send(commands)
+                results, solve_result = read_results(len(request_stats), server_count)
+                worker_stats["solves"] += 1
+                print('AMPL WORKER SOLVE RESULT: ' + str(solve_result))
+                return results
+            except Exception as e:
+                worker_stats["failures"] += 1
+                print('AMPL WORKER FAILED')
+                print(e)
+                stop_worker()
+    raise RuntimeError('AMPL WORKER UNAVAILABLE')
+
+def get_worker_stats():
+    with worker_lock:
+        stats = worker_stats.copy()
+        stats["running"] = process is not None and process.poll() is None
+    return stats
+
+atexit.register(stop_worker)
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import re
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import admission_control
+import cluster_cache
+import dispatch_counters
+import node_metrics
+import upstream_proxy
+
+# asyncio (ASGI) serving mode for the edge manager frontend
+# the dispatch and proxy routes are handled natively so many requests can be in flight on one process,
+# their blocking cluster, metrics and upstream calls run concurrently on a worker pool
+# every other route (/dev/...) is served by the same Flask app through a WSGI adapter
+
+#threads running blocking kubernetes, metrics and upstream calls
+worker_threads = 64
+
+proxy_route = re.compile(r'^/services/([^/]+)/([^/]+)/([^/]+)/([^/]+)$')
+
+executor = ThreadPoolExecutor(max_workers=worker_threads, thread_name_prefix='asgi-worker')
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(executor, func, *args)
+
+async def read_body(receive):
+    chunks = []
+    more_body = True
+    while more_body:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        more_body = message.get('more_body', False)
+    return b''.join(chunks)
+
+# blocking iterator over the request body for a worker thread, every chunk is received on the event loop
+# so the body streams to the upstream as it arrives instead of being read in full first
+def body_chunks(receive, loop):
+    more_body = True
+    while more_body:
+        message = asyncio.run_coroutine_threadsafe(receive(), loop).result()
+        if message.get('body'):
+            yield message['body']
+        more_body = message.get('more_body', False)
+
+async def send_response(send, status, body, headers=None, content_type='application/json'):
+    if isinstance(body, str):
+        body = body.encode()
+    response_headers = [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+    for name, value in (headers or {}).items():
+        response_headers.append((name.lower().encode(), str(value).encode()))
+    await send({'type' : 'http.response.start', 'status' : status, 'headers' : response_headers})
+    await send({'type' : 'http.response.body', 'body' : body})
+
+def get_header(scope, name):
+    for header_name, value in scope['headers']:
+        if header_name.decode().lower() == name:
+            return value.decode()
+    return None
+
+def retry_after_headers(result):
+    retry_after = json.loads(result).get('retry_after')
+    return {} if retry_after is None else {'Retry-After' : retry_after}
+
+def build_app(flask_app, frontend_service_functions):
+    fallback = WsgiToAsgi(flask_app)
+
+    def run_in_app_context(func, *args):
+        with flask_app.app_context():
+            return flask_app.make_response(func(*args)).get_data()
+
+    # refreshes the metrics snapshot and waits for the pod cache at the same time, then dispatches
+    async def dispatch(request_body):
+        await asyncio.gather(
+            run_blocking(node_metrics.get_snapshot, frontend_service_functions.custom_obj_api),
+            run_blocking(cluster_cache.get_pods))
+        return await run_blocking(frontend_service_functions.get_best_node_specific_service, request_body)
+
+    async def services(scope, receive, send):
+        body = await read_body(receive)
+        request_body = json.loads(body) if body else None
+        if request_body is not None and 'latency' in request_body:
+            result = await dispatch(request_body)
+            await send_response(send, 200, result, retry_after_headers(result), 'text/html; charset=utf-8')
+        else:
+            result = await run_blocking(run_in_app_context, frontend_service_functions.get_best_nodes)
+            await send_response(send, 200, result)
+
+    async def proxy(scope, receive, send, model, path):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        latency = get_header(scope, 'x-latency') or (query['latency'][0] if 'latency' in query else None)
+        #the body only has to be read up front when the latency is in it
+        if latency is None:
+            body = await read_body(receive)
+            content_length = len(body)
+            latency = json.loads(body)['latency']
+        else:
+            body = body_chunks(receive, asyncio.get_running_loop())
+            content_length = get_header(scope, 'content-length')
+
+        result = await dispatch({"model" : model, "latency" : float(latency)})
+        endpoint = json.loads(result)
+
+        if endpoint[model] == 'Does not exist, creating new deployment':
+            await send_response(send, 503, json.dumps({model : 'Model does not exist, creating new deployment. Try again later', "retry_after" : endpoint['retry_after']}), retry_after_headers(result))
+            return
+        elif endpoint[model] == 'Deployment in progress':
+            await send_response(send, 503, json.dumps({model : 'Deployment in progress. Try again later'}))
+            return
+        elif endpoint[model] == 'Unknown Service':
+            await send_response(send, 404, 'Model not found', content_type='text/html; charset=utf-8')
+            return
+        elif endpoint[model] == 'Overloaded':
+            await send_response(send, 503, json.dumps({model : 'Overloaded. Try again later', "retry_after" : endpoint['retry_after']}), retry_after_headers(result))
+            return
+
+        host = endpoint[model].split(':')[0]
+        node_name = cluster_cache.get_node_name(host)
+        if scope.get('query_string'):
+            path += '?' + scope['query_string'].decode()
+        headers = {name.decode() : value.decode() for name, value in scope['headers']}
+
+        admitted = False
+        if frontend_service_functions.admission_control_enabled:
+            admitted = await run_blocking(admission_control.acquire, model, node_name, host, latency)
+            if not admitted:
+                await send_response(send, 503, json.dumps({model : 'Overloaded. Try again later', "retry_after" : 1}), {'Retry-After' : 1})
+                return
+
+        def finish_request():
+            dispatch_counters.end_request(model, node_name)
+            if admitted:
+                admission_control.release(model, node_name)
+
+        dispatch_counters.begin_request(model, node_name)
+        try:
+            upstream = await run_blocking(upstream_proxy.open_upstream, scope['method'], endpoint[model], path, headers, body, content_length)
+        except Exception as e:
+            finish_request()
+            print('PROXY REQUEST FAILED: ' + endpoint[model])
+            print(e)
+            await send_response(send, 502, json.dumps({model : 'Model endpoint unreachable'}))
+            return
+
+        response_headers = [(name.lower().encode(), value.encode()) for name, value in upstream_proxy.response_headers(upstream).items()]
+        chunks = upstream_proxy.stream_body(upstream, finish_request)
+        try:
+            chunk = await run_blocking(next, chunks, None)
+            await send({'type' : 'http.response.start', 'status' : upstream.status, 'headers' : response_headers})
+            while chunk is not None:
+                await send({'type' : 'http.response.body', 'body' : chunk, 'more_body' : True})
+                chunk = await run_blocking(next, chunks, None)
+        finally:
+            chunks.close()
+        await send({'type' : 'http.response.body', 'body' : b''})
+
+    async def app(scope, receive, send):
+        if scope['type'] == 'http':
+            if scope['path'] == '/services' and scope['method'] == 'GET':
+                await services(scope, receive, send)
+                return
+            match = proxy_route.match(scope['path'])
+            if match is not None and scope['method'] == 'POST':
+                await proxy(scope, receive, send, match.group(1), '/' + '/'.join(match.groups()[1:]))
+                return
+        await fallback(scope, receive, send)
+
+    return app
+
+# serves the ASGI app with uvicorn on the same address as the Flask development server
+def run(flask_app, frontend_service_functions, host, port):
+    import uvicorn
+    uvicorn.run(build_app(flask_app, frontend_service_functions), host=host, port=port, lifespan='off', log_level='warning')
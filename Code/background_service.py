@@ -1,13 +1,23 @@
 # import background_service_functions
 import argparse
 import importlib
-import random
 import json
 import requests
 from datetime import datetime
 from kubernetes import client, config
+import threading
 import time
 
+import phase_metrics
+import placement_solver
+import ampl_worker
+import cluster_cache
+import cluster_inventory
+import incremental_solve
+import reconciler
+import request_classes
+import solver_cache
+
 #set k8s params
 namespace = 'deployed-services'
 config = config.load_kube_config()
@@ -24,6 +34,13 @@ background_service_functions = None
 parser = argparse.ArgumentParser()
 parser.add_argument("-mode", help="Specify 1 or 2 to choose provisioning operating mode. Defaults to 1", type=int)
 parser.add_argument("-m", help="Specify 1 or 2 to choose provisioning operating mode. Defaults to 1", type=int)
+parser.add_argument("-solver", help="Placement solver, ampl (files + AMPL/IPOPT), ampl_worker (persistent AMPL process) or heuristic (in memory). Defaults to ampl", choices=['ampl', 'ampl_worker', 'heuristic'], default='ampl')
+parser.add_argument("-inventory", help="JSON inventory file of the nodes to place models on, instead of discovering them from the API server")
+parser.add_argument("-incremental", help="Re-solve and provision only models whose request demand changed since the last cycle", action='store_true')
+parser.add_argument("-daemon", help="Keep running and provision every -interval seconds or when a trigger fires", action='store_true')
+parser.add_argument("-interval", help="Seconds between provisioning cycles in daemon mode. Defaults to 300", type=float, default=300)
+parser.add_argument("-trigger_poll", help="Seconds between trigger checks in daemon mode. Defaults to 10", type=float, default=10)
+parser.add_argument("-no_solver_cache", help="Always run the solver instead of reusing cached results for the same inputs", action='store_true')
 args = parser.parse_args()
 
 if args.mode == 2 or args.m == 2:
@@ -44,18 +61,39 @@ request_stats_endpoint = 'http://localhost:24432/dev/request_stats'
 
 server_mem_endpoint = 'http://localhost:24432/dev/server_mem_stats'
 
+metrics_endpoint = 'http://localhost:24432/dev/metrics'
+
+#daemon triggers
+#relative change of the request rate since the last cycle that starts a new one
+rate_change_threshold = 0.5
+#requests per second below which rate changes are ignored
+min_trigger_rate = 0.2
+#Ki, a node with less free memory than this is under memory pressure
+memory_pressure_threshold = 262144
+#seconds a triggered cycle waits after the previous one ended
+min_cycle_gap = 30
+
+cycle_lock = threading.Lock()
+cycle_requested = threading.Event()
+trigger_state = {"total_requests" : None, "polled_at" : None, "rate" : None, "cycle_rate" : None, "cycle_models" : None, "pressured" : set(), "reason" : None}
+daemon_stats = {"cycles" : 0, "failures" : 0, "last_cycle_seconds" : None, "triggers" : {"startup" : 0, "interval" : 0, "request_rate" : 0, "new_model" : 0, "memory_pressure" : 0}}
+
 def main():
+    cluster_inventory.refresh(v1, args.inventory)
     if args.mode == 2 or args.m == 2:
         request_stats = get_request_stats()
         node_mem = get_node_mem_metrics()
 
         solver_results = run_ampl_ipopt_solver(request_stats, node_mem)
+        if args.incremental:
+            request_stats, solver_results = incremental_solve.restrict(request_stats, solver_results, incremental_solve.last_changed)
 
         print('\nPERFORMING PROVISIONING...')
-        time1 = time.perf_counter()
-        print('PROVISIONING SUCCESSFUL: ' + str(background_service_functions.perform_provisioning(solver_results, request_stats)))
-        time2 = time.perf_counter()
-        print("Mode 2 Provision Time: " + str((time2 - time1) * 1000) + " ms")
+        with phase_metrics.timed('deployment_rollout'):
+            success = background_service_functions.perform_provisioning(solver_results, request_stats)
+        print('PROVISIONING SUCCESSFUL: ' + str(success))
+        if args.incremental and success:
+            incremental_solve.save_pending()
     else:
         model_stats = None
     
@@ -75,18 +113,42 @@ def main():
         node_mem = get_node_mem_metrics()
 
         solver_results = run_ampl_ipopt_solver(request_stats, node_mem)
+        if args.incremental:
+            request_stats, solver_results = incremental_solve.restrict(request_stats, solver_results, incremental_solve.last_changed)
 
         print('\nPERFORMING PROVISIONING...')
-        time1 = time.perf_counter()
-        print('PROVISIONING SUCCESSFUL: ' + str(background_service_functions.perform_provisioning(solver_results, request_stats)))
-        time2 = time.perf_counter()
-        print("Mode 1 Provision Time: " + str((time2 - time1) * 1000) + " ms")
+        with phase_metrics.timed('deployment_rollout'):
+            success = background_service_functions.perform_provisioning(solver_results, request_stats)
+        print('PROVISIONING SUCCESSFUL: ' + str(success))
+        if args.incremental and success:
+            incremental_solve.save_pending()
+
+# ships this run's phase histograms to the server so /dev/metrics covers provisioning too
+def post_phase_metrics():
+    try:
+        requests.post(metrics_endpoint, json=phase_metrics.export_histograms(reset=True))
+    except Exception as e:
+        print('ERROR: CANNOT POST METRICS')
+        print(e)
 
 def load_model_stats():
     return json.loads(requests.get(model_stats_endpoint).text)
 
+# streams the request log one entry per line rather than as one large JSON object
+def stream_request_stats():
+    with requests.get(request_stats_endpoint, params={'format' : 'jsonl'}, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+# solver rows built while the request log streams in, so the whole log is never held:
+# weighted request classes for backends that honor weights, otherwise one row per request
+# with only the fields the solver reads
 def load_request_stats():
-    return json.loads(requests.get(request_stats_endpoint).text)
+    if args.solver in weighted_backends:
+        return request_classes.aggregate(stream_request_stats())
+    return {str(index) : {"model" : entry['model'], "server" : entry['server'], "latency" : entry['latency']} for index, entry in enumerate(stream_request_stats())}
 
 def load_node_memory():
     return json.loads(requests.get(server_mem_endpoint).text)
@@ -103,6 +165,7 @@ def remove_old_services(model_stats):
         if (datetime.now().hour - last_request_threshold) > datetime.strptime(model_stats[name_array[0]]['last_request'], '%m/%d/%y %H:%M:%S').hour:
             print("Removing Old Service: " + currentService.metadata.name)
             background_service_functions.delete_deployment(currentService.metadata.name)
+            incremental_solve.forget_model(name_array[0])
             model_stats.pop(name_array[0])
             post_model_stats_update(model_stats)
         else:
@@ -117,6 +180,7 @@ def remove_unused_services(model_stats):
         if model_stats[name_array[0]]['num_requests'] < num_requests_threshold:
             print("Removing Rarely Used Service: " + currentService.metadata.name)
             background_service_functions.delete_deployment(currentService.metadata.name)
+            incremental_solve.forget_model(name_array[0])
             model_stats.pop(name_array[0])
             post_model_stats_update(model_stats)
         else:
@@ -142,24 +206,188 @@ def get_node_mem_metrics():
     node_mem = load_node_memory()
     return node_mem
 
-def run_ampl_ipopt_solver(request_stats, node_mem):
+# solves through the AMPL file round trip, the template has no initial values so warm_start is unused
+def run_ampl_files(request_stats, node_mem, warm_start=None):
     #solver file generation
-    print("\nMODEL FILE GENERATION SUCCESSFUL: " + str(background_service_functions.build_model_file(len(request_stats)-1)))
-    print("DATA FILE GENERATION SUCCESSFUL: " + str(background_service_functions.build_data_file(request_stats, node_mem)))
-    print("RUN FILE GENERATION SUCCESSFUL: " + str(background_service_functions.build_run_file(len(request_stats)-1)))
+    with phase_metrics.timed('file_generation'):
+        print("\nMODEL FILE GENERATION SUCCESSFUL: " + str(background_service_functions.build_model_file(len(request_stats)-1)))
+        print("DATA FILE GENERATION SUCCESSFUL: " + str(background_service_functions.build_data_file(request_stats, node_mem)))
+        print("RUN FILE GENERATION SUCCESSFUL: " + str(background_service_functions.build_run_file(len(request_stats)-1)))
 
     #run the solver
     print('\nRUNNING SOLVER...')
-    print("SOLVER SUCCESSFUL: " + str(background_service_functions.run_solver()))
-    solver_results = background_service_functions.get_solver_results(len(request_stats)-1, 5)
+    with phase_metrics.timed('solver_run'):
+        print("SOLVER SUCCESSFUL: " + str(background_service_functions.run_solver()))
+        #the run file prints rows 0..len-1, so read all of them
+        return background_service_functions.get_solver_results(len(request_stats), cluster_inventory.get_server_count())
+
+# solves with the persistent AMPL process, see ampl_worker, which keeps its own warm start
+def run_ampl_worker(request_stats, node_mem, warm_start=None):
+    print('\nRUNNING SOLVER...')
+    with phase_metrics.timed('solver_run'):
+        solver_results = ampl_worker.solve(request_stats, node_mem, background_service_functions.build_data_file, cluster_inventory.get_server_count())
+    print('SOLVER SUCCESSFUL: ' + str(ampl_worker.get_worker_stats()))
+    return solver_results
+
+# solves the same placement model in memory, see placement_solver
+def run_heuristic_solver(request_stats, node_mem, warm_start=None):
+    print('\nRUNNING SOLVER...')
+    with phase_metrics.timed('solver_run'):
+        solver_results = placement_solver.solve(request_stats, node_mem, background_service_functions.memory_requirements_table,
+        cluster_inventory.get_processing_time_table(background_service_functions.processing_time_table), cluster_inventory.get_server_ips(), warm_start)
+    print('SOLVER SUCCESSFUL: ' + str(placement_solver.solver_stats))
+    return solver_results
+
+#solver backends selectable with -solver, each takes (request_stats, node_mem, warm_start) and returns the request x server 0/1 matrix
+#request_stats rows may carry a weight, the number of requests they stand for
+solver_backends = {'ampl' : run_ampl_files, 'ampl_worker' : run_ampl_worker, 'heuristic' : run_heuristic_solver}
+#backends whose objective honors row weights, the AMPL template has no weight param yet so it gets one row per request
+weighted_backends = {'heuristic'}
+
+# runs the selected backend, reusing cached results for identical inputs
+def solve_classes(classes, node_mem, warm_start=None):
+    class_results = None
+    if not args.no_solver_cache:
+        cache_key = solver_cache.cache_key(args.solver, classes, node_mem, background_service_functions.memory_requirements_table,
+        cluster_inventory.get_processing_time_table(background_service_functions.processing_time_table), cluster_inventory.get_server_ips())
+        class_results = solver_cache.lookup(cache_key, classes)
+        print('SOLVER CACHE ' + ('HIT' if class_results is not None else 'MISS') + ': ' + str(solver_cache.get_cache_stats()))
+    if class_results is None:
+        class_results = solver_backends[args.solver](classes, node_mem, warm_start)
+        if not args.no_solver_cache:
+            solver_cache.store(cache_key, classes, class_results)
+    return class_results
+
+# (model, server ip) of the deployments in the namespace
+def deployed_placements():
+    addresses = {cluster_inventory.get_server_name(j) : address for j, address in enumerate(cluster_inventory.get_server_ips())}
+    current = reconciler.current_placements(apps_api.list_namespaced_deployment(namespace, watch=False).items)
+    return {(model, addresses[node_name]) for model, node_name in current if node_name in addresses}
+
+# re-solves the classes of models whose demand changed or whose deployments are gone, keeping the other models' rows and servers
+def solve_incremental(classes, node_mem):
+    state = incremental_solve.load_state()
+    summary = incremental_solve.demand_summary(classes)
+    missing = incremental_solve.missing_models(state, deployed_placements())
+    if missing:
+        print('MODELS WITH MISSING DEPLOYMENTS: ' + str(sorted(missing)))
+    changed = incremental_solve.changed_models(summary, state, missing)
+    print('MODELS TO RE-SOLVE: ' + str(sorted(changed)))
+    active_classes, indices = incremental_solve.select_classes(classes, changed)
+    active_results = []
+    if active_classes:
+        #mode 1 reports free memory, which already excludes the running pinned models, mode 2 reports allocatable memory
+        if args.mode == 2 or args.m == 2:
+            node_mem = incremental_solve.reserve_pinned(node_mem, state, changed, background_service_functions.memory_requirements_table,
+            placement_solver.memory_requirement_unit)
+        active_results = solve_classes(active_classes, node_mem, incremental_solve.warm_start(state, changed))
+    return incremental_solve.merge(classes, summary, indices, active_results, state, cluster_inventory.get_server_ips())
+
+# solves over the rows of load_request_stats, request classes or single requests, one result row each
+def run_ampl_ipopt_solver(request_stats, node_mem):
+    node_mem = cluster_inventory.get_memory_table(node_mem)
+    print('\nSOLVER ROWS: ' + str(len(request_stats)) + ' FOR ' + str(sum(row.get('weight', 1) for row in request_stats.values())) + ' REQUESTS')
+    if args.incremental:
+        solver_results = solve_incremental(request_stats, node_mem)
+    else:
+        solver_results = solve_classes(request_stats, node_mem)
 
     #print the solver results
     print('\nSOLVER RESULTS:')
-    for i in range(0, 7):
+    for i in range(0, min(7, len(solver_results))):
         print(solver_results[i])
 
     #return solver results
     return solver_results
 
+# one provisioning cycle, cycles never overlap and a failed one does not stop the daemon
+def run_cycle(reason):
+    with cycle_lock:
+        print('\nPROVISIONING CYCLE: ' + reason.upper())
+        daemon_stats["triggers"][reason] += 1
+        try:
+            model_stats = load_model_stats()
+            trigger_state["cycle_models"] = set(model_stats)
+            trigger_state["cycle_rate"] = trigger_state["rate"]
+        except Exception as e:
+            print('ERROR: CANNOT GET DATA')
+            print(e)
+        start = time.monotonic()
+        try:
+            main()
+        except Exception as e:
+            print('PROVISIONING CYCLE FAILED')
+            print(e)
+            daemon_stats["failures"] += 1
+        post_phase_metrics()
+        daemon_stats["cycles"] += 1
+        daemon_stats["last_cycle_seconds"] = round(time.monotonic() - start, 2)
+        print('CYCLE DONE IN ' + str(daemon_stats["last_cycle_seconds"]) + ' S: ' + str(daemon_stats))
+
+# returns the reason a cycle should start now, or None
+def check_triggers():
+    model_stats = load_model_stats()
+    now = time.monotonic()
+    total_requests = sum(stats['num_requests'] for stats in model_stats.values())
+    if trigger_state["total_requests"] is not None and total_requests >= trigger_state["total_requests"]:
+        trigger_state["rate"] = (total_requests - trigger_state["total_requests"]) / (now - trigger_state["polled_at"])
+    trigger_state["total_requests"] = total_requests
+    trigger_state["polled_at"] = now
+
+    if trigger_state["cycle_models"] is not None and set(model_stats) - trigger_state["cycle_models"]:
+        return 'new_model'
+
+    rate = trigger_state["rate"]
+    if trigger_state["cycle_rate"] is None:
+        #the first measured rate is the baseline when the last cycle started before any was measured
+        trigger_state["cycle_rate"] = rate
+    cycle_rate = trigger_state["cycle_rate"]
+    if rate is not None and cycle_rate is not None and max(rate, cycle_rate) >= min_trigger_rate:
+        if abs(rate - cycle_rate) > rate_change_threshold * max(cycle_rate, min_trigger_rate):
+            return 'request_rate'
+
+    #only a node newly under pressure triggers, not one that stays there
+    pressured = {address for address, free_memory in load_node_memory().items() if free_memory < memory_pressure_threshold}
+    newly_pressured = pressured - trigger_state["pressured"]
+    trigger_state["pressured"] = pressured
+    if newly_pressured:
+        return 'memory_pressure'
+    return None
+
+def trigger_loop():
+    while True:
+        time.sleep(args.trigger_poll)
+        try:
+            reason = check_triggers()
+        except Exception as e:
+            print('TRIGGER CHECK FAILED')
+            print(e)
+            continue
+        if reason is not None and not cycle_requested.is_set():
+            trigger_state["reason"] = reason
+            cycle_requested.set()
+
+# runs cycles forever, every -interval seconds or sooner when a trigger fires
+# the informer caches, inventory, AMPL worker and solver state stay loaded between cycles
+# triggers that fire during a cycle are coalesced into one cycle after it
+def run_daemon():
+    print('DAEMON MODE: CYCLE EVERY ' + str(args.interval) + ' S, TRIGGER CHECK EVERY ' + str(args.trigger_poll) + ' S')
+    cluster_cache.start_cluster_cache(v1)
+    threading.Thread(target=trigger_loop, name='provisioning-triggers', daemon=True).start()
+    reason = 'startup'
+    while True:
+        run_cycle(reason)
+        finished = time.monotonic()
+        if cycle_requested.wait(args.interval):
+            time.sleep(max(0, finished + min_cycle_gap - time.monotonic()))
+            reason = trigger_state["reason"]
+            cycle_requested.clear()
+        else:
+            reason = 'interval'
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if args.daemon:
+        run_daemon()
+    else:
+        main()
+        post_phase_metrics()
\ No newline at end of file
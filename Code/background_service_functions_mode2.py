@@ -1,9 +1,16 @@
 from kubernetes import client, config
 from flask import jsonify
 from os import path
+import contextlib
 import os
 import yaml
 
+import cluster_inventory
+import manifest_templates
+import model_profiles
+import reconciler
+import rollout
+
 #set k8s params
 namespace = 'deployed-services'
 config = config.load_kube_config()
@@ -15,12 +22,12 @@ deployment = client.V1Deployment()
 custom_obj_api = client.CustomObjectsApi()
 
 memory_requirements_table = {"resnet" : 500, "nginx" : 200, "nginxgpu" : 200, "hpt" : 1000}
-server_ip_table = {"192.168.1.41" : 0, "192.168.1.23" : 1, "192.168.1.44" : 2, "192.168.1.36" : 3, "192.168.1.53" : 4}
 processing_time_table = {"resnet" : {"192.168.1.41" : 0.5, "192.168.1.23" : 1.3, "192.168.1.44" : 0.5, "192.168.1.36" : 0.5, "192.168.1.53" : 0.2}, 
 "nginx" : {"192.168.1.41" : 0.1, "192.168.1.23" : 0.15, "192.168.1.44" : 0.1, "192.168.1.36" : 0.1, "192.168.1.53" : 0.07}, 
 "nginxgpu" : {"192.168.1.41" : 0.1, "192.168.1.23" : 0.15, "192.168.1.44" : 0.1, "192.168.1.36" : 0.1, "192.168.1.53" : 0.07}, 
 "hpt" : {"192.168.1.41" : 1, "192.168.1.23" : 1.5, "192.168.1.44" : 1, "192.168.1.36" : 1, "192.168.1.53" : 0.8}}
-server_name_table = {"0" : "jetsonnanoone", "1" : "jetsonnanotwo", "2" : "jetsonnanothree", "3" : "jetsonnanofour", "4" : "jetsonagx"}
+#measured values from the newest model profile (see profile_models.py) replace the ones above
+model_profiles.apply_profile(processing_time_table, memory_requirements_table)
 
 # creates a new deployment based on a YAML config file
 def create_deployment(target):
@@ -90,7 +97,7 @@ def build_run_file(num_requests):
         with open("ampl_files/template.run","r") as template, open("ampl_files/solver_run.run", "w") as run_file:
             for line in template:
                 if '<num_req>' in line:
-                    run_file.write("print {i in 0.." + str(num_requests) + ", j in 0.." + str(len(server_ip_table)-1) + "}: probability[i,j] >> ampl_files/solver_results.txt;\n")
+                    run_file.write("print {i in 0.." + str(num_requests) + ", j in 0.." + str(cluster_inventory.get_server_count()-1) + "}: probability[i,j] >> ampl_files/solver_results.txt;\n")
                 else:
                     run_file.write(line)
     except Exception as e:
@@ -107,6 +114,9 @@ def build_model_file(num_models):
                     model_file.write("set request := {0.." + str(num_models) + "};\n")
                 elif '<num_models>' in line:
                     model_file.write("set mlmodel := {0.." + str(num_models) + "};\n")
+                #the template's own server set is replaced too, so models sized for 5 nodes work for any inventory
+                elif cluster_inventory.is_server_set_line(line):
+                    model_file.write("set server := {0.." + str(cluster_inventory.get_server_count()-1) + "};\n")
                 else:
                     model_file.write(line)
     except Exception as e:
@@ -115,19 +125,16 @@ def build_model_file(num_models):
         return False
     return True
 
-def build_data_file(request_stats, available_memory):
+# writes the solver data to ampl_files/solver_data.dat, or to output (any open text file) when given
+def build_data_file(request_stats, available_memory, output=None):
     #get the request stats
     try:
-        with open("ampl_files/template.dat", "r") as template, open("ampl_files/solver_data.dat", "w") as data_file:
+        with open("ampl_files/template.dat", "r") as template, (open("ampl_files/solver_data.dat", "w") if output is None else contextlib.nullcontext(output)) as data_file:
             #memory copy
             for line in template:
                 #print('SERVER MEMORY')
                 if '<start_mem_server>' in line:
-                    data_file.write(str(0) + " " + str(available_memory['192.168.1.41']) + "\n")
-                    data_file.write(str(1) + " " + str(available_memory['192.168.1.23']) + "\n")
-                    data_file.write(str(2) + " " + str(available_memory['192.168.1.44']) + "\n")
-                    data_file.write(str(3) + " " + str(available_memory['192.168.1.36']) + "\n")
-                    data_file.write(str(4) + " " + str(available_memory['192.168.1.53']) + ";\n")
+                    data_file.write("\n".join(str(j) + " " + str(cluster_inventory.get_memory(available_memory, j)) for j in range(cluster_inventory.get_server_count())) + ";\n")
                 #memory requirement
                 elif '<start_mem_req>' in line:
                     for x in range(0, len(request_stats)):
@@ -139,39 +146,28 @@ def build_data_file(request_stats, available_memory):
                 #RTT
                 elif '<begin_rtt>' in line:
                     for k in range(0, len(request_stats)):
-                        curr_request = request_stats[str(k)]
-
-                        if curr_request['server'] == "192.168.1.41":
-                            data_file.write(str(k) + " " + str(curr_request['latency']) + " 9999 9999 9999 9999")
-                        elif curr_request['server'] == "192.168.1.23":
-                            data_file.write(str(k) + " 9999 " + str(curr_request['latency']) + " 9999 9999 9999")
-                        elif curr_request['server'] == "192.168.1.44":
-                            data_file.write(str(k) + " 9999 9999 " + str(curr_request['latency']) + " 9999 9999")
-                        elif curr_request['server'] == "192.168.1.36":
-                            data_file.write(str(k) + " 9999 9999 9999 " + str(curr_request['latency']) + " 9999")
-                        elif curr_request['server'] == "192.168.1.53":
-                            data_file.write(str(k) + " 9999 9999 9999 9999 " + str(curr_request['latency']))
+                        data_file.write(str(k) + " " + " ".join(cluster_inventory.rtt_row(request_stats[str(k)])))
 
                         if k == len(request_stats)-1:
                             data_file.write(";\n")
                         else:
                             data_file.write("\n")
                 #try the processing time of the specific model requested on each server in each row (request)
-                #so if request 5 is for resnet, then row 5 will be the exec time of resnet on all 5 servers
+                #so if request 5 is for resnet, then row 5 will be the exec time of resnet on every server
                 elif '<begin_exec_time>' in line:
+                    exec_time_rows = {}
                     for y in range(0, len(request_stats)):
-                        curr_request = request_stats[str(y)]
-                        data_file.write(str(y) + " " + 
-                        str(processing_time_table[curr_request['model']]['192.168.1.41']) + " " +
-                        str(processing_time_table[curr_request['model']]['192.168.1.23']) + " " +
-                        str(processing_time_table[curr_request['model']]['192.168.1.44']) + " " +
-                        str(processing_time_table[curr_request['model']]['192.168.1.36']) + " " +
-                        str(processing_time_table[curr_request['model']]['192.168.1.53']))
+                        model = request_stats[str(y)]['model']
+                        if model not in exec_time_rows:
+                            exec_time_rows[model] = " ".join(cluster_inventory.exec_time_row(processing_time_table, model))
+                        data_file.write(str(y) + " " + exec_time_rows[model])
 
                         if y == len(request_stats)-1:
                             data_file.write(";\n")
                         else:
                             data_file.write("\n")
+                elif cluster_inventory.server_columns_line(line) is not None:
+                    data_file.write(cluster_inventory.server_columns_line(line))
                 else:
                     data_file.write(line)
     except Exception as e:
@@ -200,10 +196,8 @@ def get_solver_results(request_count, server_count):
     with open('ampl_files/solver_results.txt', 'r') as file:
         for i in range(0, request_count):
             for j in range(0, server_count):
-                curr_result = file.readline()
-                curr_num = int(curr_result[0 : 1])
-                solver_results[i][j] = curr_num
-    file.close()
+                #IPOPT values are not exactly 0 or 1, e.g. 0.9999999 or 1e-09
+                solver_results[i][j] = int(round(float(file.readline())))
     #clear the file
     open('ampl_files/solver_results.txt', 'w').close()
     return solver_results
@@ -211,90 +205,52 @@ def get_solver_results(request_count, server_count):
 def check_model_available(model, server_name):
     pods = v1.list_namespaced_pod(namespace='deployed-services')
     for currentPod in pods.items:
-        if model in currentPod.metadata.name and currentPod.spec.node_name == server_name:
+        if currentPod.metadata.name.startswith(reconciler.pod_prefix(model, server_name)) and currentPod.spec.node_name == server_name:
             if currentPod.status.container_statuses is not None:
                 return currentPod.status.container_statuses[0].ready
     return False
 
-def generate_deployment_yaml(model, server_name):
-    if path.exists('deployment_files/' + model + '-' + server_name + '-deployment.yaml'):
-        return model + "-" + server_name
-    else:
-        try:
-            with open('deployment_files/' + model + "-deployment-template.yaml","r") as template, open('deployment_files/' + model + "-" + server_name +"-deployment.yaml", "w") as deployment_file:
-                for line in template:
-                    if '<node-name>' in line:
-                        deployment_file.write("      nodeName: " + server_name + "\n")
-                    elif '<app-name>' in line:
-                        deployment_file.write("      app: " + model + "-" + server_name + "\n")
-                    elif '<app-name-template>' in line:
-                        deployment_file.write("        app: " + model + "-" + server_name + "\n")
-                    elif '<deployment-name>' in line:
-                        deployment_file.write("  name: " + model + "-" + server_name + "-deployment" + "\n")
-                    else:
-                        deployment_file.write(line)
-            deployment_file.close()
-            generate_service_yaml(model, server_name)
-            return model + "-" + server_name
-        except Exception as e:
-            print('Deployment File Creation Failed')
-            return False
-    return False
-
-def generate_service_yaml(model, server_name):
-    if path.exists('deployment_files/' + model + '-' + server_name + '-service.yaml'):
+# creates the deployment and service of model on server_name from the cached templates without touching disk
+# run by the rollout for every placement it needs
+def provision_model(model, server_name):
+    try:
+        resp = apps_api.create_namespaced_deployment(body=manifest_templates.render_deployment(model, server_name), namespace=namespace)
+        print("Deployment created. status='%s'" % resp.metadata.name)
+    except Exception as e:
+        print(e)
+        return False
+    try:
+        resp = api_instance.create_namespaced_service(body=manifest_templates.render_service(model, server_name), namespace=namespace)
+        print("Service created. status='%s'" % resp.metadata.name)
         return True
-    else:
-        try:
-            with open('deployment_files/' + model + "-service-template.yaml","r") as template, open('deployment_files/' + model + "-" + server_name +"-service.yaml", "w") as service_file:
-                for line in template:
-                    if '<service-name>' in line:
-                        service_file.write("  name: " + model + "-" + server_name + "\n")
-                    elif '<deployment-name>' in line:
-                        service_file.write("    app: " + model + "-" + server_name + "\n")
-                    else:
-                        service_file.write(line)
-            service_file.close()
-        except Exception as e:
-            print('Service File Creation Failed')
-            return False
-    return False
+    except Exception as e:
+        print(e)
+        apps_api.delete_namespaced_deployment(name=model + "-" + server_name + "-deployment", namespace=namespace)
+        return False
 
-def perform_provisioning(solver_results, request_stats):
-    modified_in_run = [{"resnet" : False, "nginx" : False, "nginxgpu" : False, "hpt" : False},
-    {"resnet" : False, "nginx" : False, "nginxgpu" : False, "hpt" : False},
-    {"resnet" : False, "nginx" : False, "nginxgpu" : False, "hpt" : False},
-    {"resnet" : False, "nginx" : False, "nginxgpu" : False, "hpt" : False},
-    {"resnet" : False, "nginx" : False, "nginxgpu" : False, "hpt" : False}]
-    for i in range(0, len(solver_results)-1):
-        curr_request = request_stats[str(i)]
-        model = curr_request['model']
-        for j in range(0, len(curr_request)-1):
-            model_available = check_model_available(model, server_name_table[str(j)])
+# removes the deployment and service of model on server_name without listing the deployments first
+def remove_placement(model, server_name):
+    target = model + '-' + server_name
+    api_instance.delete_namespaced_service(name=target, namespace=namespace)
+    apps_api.delete_namespaced_deployment(name=target + "-deployment", namespace=namespace, body=client.V1DeleteOptions(propagation_policy="Foreground", grace_period_seconds=5))
 
-            #if we want it on this node
-            if solver_results[i][j] == 1 and not model_available:
-                print('ATTEMPTING PROVISIONING OF: ' + model + ' ON SERVER ' + server_name_table[str(j)])
-                #deploy
-                try:
-                    deployment_filename = generate_deployment_yaml(model, server_name_table[str(j)])
-                    create_deployment(deployment_filename)
-                    done = False
-                    
-                    while(not done):
-                        done = check_model_available(model, server_name_table[str(j)])
+# diffs the solver placement against the current deployments, creates the missing ones at once
+# and then deletes the placements of the solved models the solver no longer wants
+def perform_provisioning(solver_results, request_stats):
+    server_names = [cluster_inventory.get_server_name(j) for j in range(cluster_inventory.get_server_count())]
+    current = reconciler.current_placements(apps_api.list_namespaced_deployment(namespace, watch=False).items)
+    solved_models = {request_stats[str(i)]['model'] for i in range(0, len(solver_results))}
+    creates, deletes = reconciler.plan(reconciler.desired_placements(solver_results, request_stats, server_names), current, solved_models)
+    for model, server_name in creates:
+        print('ATTEMPTING PROVISIONING OF: ' + model + ' ON SERVER ' + server_name)
+    success = rollout.roll_out(creates, v1, namespace, provision_model)
 
-                    modified_in_run[j][model] = True
-                except Exception as e:
-                    print('ERROR WITH PROVISIONING DEPLOYMENT')
-                    print(e)
-                    raise
-            elif solver_results[i][j] == 0 and model_available and modified_in_run[j][model] == False:
-                print('ATTEMPTING TO DELETE: ' + model + ' ON SERVER ' + server_name_table[str(j)])
-                try:
-                    delete_deployment(model + '-' + server_name_table[str(j)])
-                except Exception as e:
-                    print('PROVISIONING DELETION FAILURE')
-                    print(e)
-                    raise
-    return True
\ No newline at end of file
+    for model, server_name in deletes:
+        print('ATTEMPTING TO DELETE: ' + model + ' ON SERVER ' + server_name)
+        try:
+            remove_placement(model, server_name)
+        except Exception as e:
+            print('PROVISIONING DELETION FAILURE')
+            print(e)
+            raise
+    return success
@@ -0,0 +1,66 @@
+import argparse
+import random
+from collections import deque
+
+import load_balancing
+
+# simulated comparison of min-cpu and power-of-two-choices dispatch
+# every node serves one request at a time (FIFO), the cpu snapshot is only refreshed
+# every metrics_ttl seconds like node_metrics, while p2c also sees the live in-flight
+# count the frontend keeps per node, prints response time percentiles for each policy
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-requests", help="Number of simulated requests. Defaults to 20000", type=int, default=20000)
+parser.add_argument("-load", help="Offered load as a fraction of total cluster capacity. Defaults to 0.7", type=float, default=0.7)
+parser.add_argument("-metrics_ttl", help="Seconds between cpu snapshots. Defaults to 2", type=float, default=2.0)
+parser.add_argument("-seed", help="Random seed. Defaults to 1", type=int, default=1)
+args = parser.parse_args()
+
+#mean resnet processing time (seconds) per node, as in processing_time_table
+processing_times = {"192.168.1.41" : 0.5, "192.168.1.23" : 1.3, "192.168.1.44" : 0.5, "192.168.1.36" : 0.5, "192.168.1.53" : 0.2}
+
+def percentile(values, quantile):
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+def simulate(policy, seed):
+    rng = random.Random(seed)
+    hosts = list(processing_times)
+    capacity = sum(1 / processing_times[host] for host in hosts)
+    free_at = {host : 0.0 for host in hosts}
+    completions = {host : deque() for host in hosts}
+    snapshot_cpu = {host : 0.0 for host in hosts}
+    next_snapshot = 0.0
+    now = 0.0
+    response_times = []
+
+    def inflight(host):
+        queue = completions[host]
+        while queue and queue[0] <= now:
+            queue.popleft()
+        return len(queue)
+
+    for _ in range(args.requests):
+        now += rng.expovariate(args.load * capacity)
+        if now >= next_snapshot:
+            #a busy node reports ~1000 millicores per queued request
+            snapshot_cpu = {host : 1000.0 * min(inflight(host), 4) for host in hosts}
+            next_snapshot = now + args.metrics_ttl
+
+        if policy == 'cpu':
+            host = min(hosts, key=lambda candidate: snapshot_cpu[candidate])
+        else:
+            host = load_balancing.pick_two_choices(hosts, inflight, lambda candidate: snapshot_cpu[candidate], rng)
+
+        start = max(now, free_at[host])
+        free_at[host] = start + rng.expovariate(1 / processing_times[host])
+        completions[host].append(free_at[host])
+        response_times.append(free_at[host] - now)
+
+    response_times.sort()
+    return response_times
+
+if __name__ == "__main__":
+    print('Requests: ' + str(args.requests) + ', Load: ' + str(args.load) + ', Metrics TTL: ' + str(args.metrics_ttl) + ' s\n')
+    for policy in ['cpu', 'p2c']:
+        times = simulate(policy, args.seed)
+        print(policy.ljust(4) + ' p50: %8.3f s  p95: %8.3f s  p99: %8.3f s  max: %8.3f s' % (percentile(times, 0.50), percentile(times, 0.95), percentile(times, 0.99), times[-1]))
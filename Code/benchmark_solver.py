@@ -0,0 +1,77 @@
+import argparse
+import json
+import random
+import time
+
+import background_service_functions
+import cluster_inventory
+import placement_solver
+import request_classes
+
+# times the in-memory placement solver and, with -ampl, the AMPL file round trip on the
+# same request stats, then compares their objectives and how many rows they agree on
+# run from the Code directory like background_service.py so ampl_files/ resolves
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-requests", help="Number of synthetic requests. Defaults to 500", type=int, default=500)
+parser.add_argument("-stats", help="JSON file of request stats ({index : entry}) to use instead of synthetic requests")
+parser.add_argument("-memory", help="Free memory per node in Ki. Defaults to 2000000", type=int, default=2000000)
+parser.add_argument("-repeat", help="Timed runs of the in-memory solver. Defaults to 10", type=int, default=10)
+parser.add_argument("-ampl", help="Also run the AMPL solver", action='store_true')
+parser.add_argument("-aggregate", help="Solve weighted request classes instead of individual requests", action='store_true')
+parser.add_argument("-inventory", help="JSON inventory file of the nodes, instead of discovering them from the API server")
+parser.add_argument("-seed", help="Random seed. Defaults to 1", type=int, default=1)
+args = parser.parse_args()
+
+cluster_inventory.refresh(background_service_functions.v1, args.inventory)
+server_ips = cluster_inventory.get_server_ips()
+processing_times = cluster_inventory.get_processing_time_table(background_service_functions.processing_time_table)
+
+def synthetic_request_stats(count, seed):
+    rng = random.Random(seed)
+    models = list(background_service_functions.memory_requirements_table)
+    return {str(i) : {"model" : rng.choice(models), "server" : rng.choice(server_ips), "latency" : rng.randint(1, 20)} for i in range(count)}
+
+def run_ampl(request_stats, node_mem):
+    background_service_functions.build_model_file(len(request_stats)-1)
+    background_service_functions.build_data_file(request_stats, node_mem)
+    background_service_functions.build_run_file(len(request_stats)-1)
+    background_service_functions.run_solver()
+    return background_service_functions.get_solver_results(len(request_stats), len(server_ips))
+
+def matrix_objective(problem, results):
+    assignment = [row.index(1) if 1 in row else None for row in results]
+    return sum(problem["cost"][i, j] * problem["weight"][i] for i, j in enumerate(assignment) if j is not None)
+
+if __name__ == "__main__":
+    if args.stats:
+        with open(args.stats) as f:
+            request_stats = json.load(f)
+    else:
+        request_stats = synthetic_request_stats(args.requests, args.seed)
+    node_mem = {ip : args.memory for ip in server_ips}
+    solver_input = request_stats
+    if args.aggregate:
+        solver_input = request_classes.aggregate(request_stats[str(i)] for i in range(len(request_stats)))
+    problem = placement_solver.build_problem(solver_input, node_mem, background_service_functions.memory_requirements_table,
+    processing_times, server_ips)
+
+    times = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        results = placement_solver.solve(solver_input, node_mem, background_service_functions.memory_requirements_table,
+        processing_times, server_ips)
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    print('Requests: ' + str(len(request_stats)) + ', Solver rows: ' + str(len(solver_input)) + ', Servers: ' + str(len(server_ips)) + '\n')
+    print('in-memory  median: %10.2f ms  objective: %12.2f  method: %s  lower bound: %s' % (times[len(times) // 2],
+    placement_solver.solver_stats["objective"], placement_solver.solver_stats["method"], str(placement_solver.solver_stats["lower_bound"])))
+
+    if args.ampl:
+        start = time.perf_counter()
+        ampl_results = run_ampl(solver_input, node_mem)
+        elapsed = (time.perf_counter() - start) * 1000
+        rows = len(ampl_results)
+        agreement = sum(1 for i in range(rows) if ampl_results[i] == results[i])
+        print('ampl       total:  %10.2f ms  objective: %12.2f' % (elapsed, matrix_objective(problem, ampl_results)))
+        print('rows in agreement: %d / %d' % (agreement, rows))
@@ -0,0 +1,195 @@
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+import threading
+import time
+
+# local copy of the pods, services and endpoints in the serving namespace
+# (plus the cluster's nodes)
+# kept current by one list + watch loop per resource kind (informer style)
+# so the dispatch path never has to call the API server
+
+namespace = 'deployed-services'
+#seconds before a watch is closed and the kind is relisted from scratch
+resync_period = 300
+#seconds to wait before reconnecting a failed watch
+retry_delay = 2
+#seconds dispatch waits for the first list before falling back to the API
+initial_sync_timeout = 10
+
+cache_lock = threading.Lock()
+stores = {"pods" : {}, "services" : {}, "endpoints" : {}, "nodes" : {}}
+list_functions = {}
+synced_events = {"pods" : threading.Event(), "services" : threading.Event(), "endpoints" : threading.Event(), "nodes" : threading.Event()}
+#kinds whose first list did not finish within initial_sync_timeout, read from the API server without waiting again
+unsynced_kinds = set()
+kind_stats = {}
+#callables run as listener(kind, name) after every change, name is None after a relist
+listeners = []
+route_lookup_stats = {"count" : 0, "total_ms" : 0.0, "max_ms" : 0.0, "last_ms" : 0.0}
+started = False
+
+def new_kind_stats():
+    return {"objects" : 0, "events" : 0, "resyncs" : 0, "expired_watches" : 0, "errors" : 0, "last_resync" : None, "last_event" : None, "watching" : False}
+
+# starts one watch thread per resource kind, safe to call more than once
+def start_cluster_cache(v1):
+    global started
+    with cache_lock:
+        if started:
+            return
+        started = True
+    list_functions["pods"] = v1.list_namespaced_pod
+    list_functions["services"] = v1.list_namespaced_service
+    list_functions["endpoints"] = v1.list_namespaced_endpoints
+    list_functions["nodes"] = v1.list_node
+    for kind in stores:
+        kind_stats[kind] = new_kind_stats()
+        thread = threading.Thread(target=run_informer, args=(kind,), name='cluster-cache-' + kind, daemon=True)
+        thread.start()
+
+# registers a callback that is told about every change to the cache
+def add_listener(listener):
+    listeners.append(listener)
+
+def notify_listeners(kind, name):
+    for listener in listeners:
+        try:
+            listener(kind, name)
+        except Exception as e:
+            print(e)
+
+# nodes are cluster scoped, everything else lives in the serving namespace
+def list_arguments(kind):
+    if kind == "nodes":
+        return {}
+    return {"namespace" : namespace}
+
+# replaces the whole store for a kind with a fresh list, returns the resource version to watch from
+def relist(kind):
+    result = list_functions[kind](watch=False, **list_arguments(kind))
+    fresh = {}
+    for item in result.items:
+        fresh[item.metadata.name] = item
+    with cache_lock:
+        stores[kind] = fresh
+        kind_stats[kind]["objects"] = len(fresh)
+        kind_stats[kind]["resyncs"] += 1
+        kind_stats[kind]["last_resync"] = time.time()
+    synced_events[kind].set()
+    notify_listeners(kind, None)
+    return result.metadata.resource_version
+
+def apply_event(kind, event):
+    event_type = event['type']
+    item = event['object']
+    with cache_lock:
+        store = stores[kind]
+        if event_type == 'DELETED':
+            store.pop(item.metadata.name, None)
+        else:
+            store[item.metadata.name] = item
+        kind_stats[kind]["objects"] = len(store)
+        kind_stats[kind]["events"] += 1
+        kind_stats[kind]["last_event"] = time.time()
+    notify_listeners(kind, item.metadata.name)
+
+# list then watch forever, relisting when the watch times out or its resource version expires
+def run_informer(kind):
+    while True:
+        try:
+            resource_version = relist(kind)
+            kind_stats[kind]["watching"] = True
+            stream = watch.Watch().stream(list_functions[kind], resource_version=resource_version, timeout_seconds=resync_period, **list_arguments(kind))
+            for event in stream:
+                if event['type'] == 'ERROR':
+                    #410 Gone, the resource version is too old to resume from
+                    kind_stats[kind]["expired_watches"] += 1
+                    break
+                if event['type'] == 'BOOKMARK':
+                    continue
+                apply_event(kind, event)
+        except ApiException as e:
+            if e.status == 410:
+                kind_stats[kind]["expired_watches"] += 1
+            else:
+                print('CLUSTER CACHE WATCH FAILED: ' + kind)
+                print(e)
+                kind_stats[kind]["errors"] += 1
+                time.sleep(retry_delay)
+        except Exception as e:
+            print('CLUSTER CACHE WATCH FAILED: ' + kind)
+            print(e)
+            kind_stats[kind]["errors"] += 1
+            time.sleep(retry_delay)
+        kind_stats[kind]["watching"] = False
+
+def get_items(kind):
+    if not synced_events[kind].is_set() and (kind in unsynced_kinds or not synced_events[kind].wait(initial_sync_timeout)):
+        #cache never came up, answer from the API server rather than with nothing
+        #once a wait timed out, later calls fall back at once until the kind syncs
+        unsynced_kinds.add(kind)
+        return list_functions[kind](watch=False, **list_arguments(kind)).items
+    with cache_lock:
+        return list(stores[kind].values())
+
+# gets every pod in the namespace from the cache
+def get_pods():
+    return get_items("pods")
+
+# gets every service in the namespace from the cache
+def get_services():
+    return get_items("services")
+
+# gets every endpoints object in the namespace from the cache
+def get_endpoints():
+    return get_items("endpoints")
+
+# gets every node in the cluster from the cache
+def get_nodes():
+    return get_items("nodes")
+
+# gets the name of the node with the given internal ip, None if it is not cached
+def get_node_name(host_ip):
+    for node in get_nodes():
+        for address in node.status.addresses:
+            if address.address == host_ip:
+                return node.metadata.name
+    return None
+
+# changes every time the cached kind is relisted or receives an event
+def get_version(kind):
+    with cache_lock:
+        return kind_stats[kind]["resyncs"] + kind_stats[kind]["events"]
+
+# gets the NodePort of the first service whose name starts with the target model
+def get_service_port(target):
+    for currentService in get_services():
+        if target == currentService.metadata.name.split('-')[0]:
+            return currentService.spec.ports[0].node_port
+    return None
+
+def record_route_lookup(elapsed_ms):
+    with cache_lock:
+        route_lookup_stats["count"] += 1
+        route_lookup_stats["total_ms"] += elapsed_ms
+        route_lookup_stats["last_ms"] = elapsed_ms
+        if elapsed_ms > route_lookup_stats["max_ms"]:
+            route_lookup_stats["max_ms"] = elapsed_ms
+
+# staleness, resync and event counters for every cached kind plus route lookup timing
+def get_cache_stats():
+    now = time.time()
+    result = {}
+    with cache_lock:
+        for kind in kind_stats:
+            stats = kind_stats[kind].copy()
+            freshest = max(stats["last_resync"] or 0, stats["last_event"] or 0)
+            stats["synced"] = synced_events[kind].is_set()
+            stats["seconds_since_resync"] = None if stats["last_resync"] is None else now - stats["last_resync"]
+            stats["seconds_since_update"] = None if freshest == 0 else now - freshest
+            result[kind] = stats
+        lookups = route_lookup_stats.copy()
+    if lookups["count"] > 0:
+        lookups["mean_ms"] = lookups["total_ms"] / lookups["count"]
+    result["route_lookup"] = lookups
+    return result
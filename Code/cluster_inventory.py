@@ -0,0 +1,118 @@
+import json
+import os
+import re
+
+import cluster_cache
+
+# the nodes the solver places models on, discovered from the API server or loaded from
+# an inventory file for a local stand-in cluster
+# every node name keeps the integer index it was first given (saved in index_file), and
+# solver columns are the present nodes in index order, so a node that leaves and comes
+# back lands in the same relative position
+# inventory file format: {"nodes" : [{"name" : str, "address" : str, "memory" : Ki (optional),
+# "processing_times" : {model : seconds} (optional)}]}
+
+index_file = 'cluster_inventory.json'
+#rtt used for servers a request did not come from
+unreachable_rtt = 9999
+#AMPL template lines sized by the server count: the server set declaration (or its
+#<num_servers> marker) and the column header of a request x server table, "param rtt: 0 1 2 3 4 :="
+server_set_pattern = re.compile(r'^\s*set\s+server\b')
+server_columns_pattern = re.compile(r'^(\s*param\s+\w+\s*:)[\s\d]+:=')
+
+servers = []
+server_addresses = []
+#{address : {model : seconds}} from the inventory file
+processing_time_overrides = {}
+
+def load_indices():
+    try:
+        with open(index_file) as file:
+            return json.load(file)
+    except Exception:
+        return {}
+
+def save_indices(indices):
+    temp_path = index_file + '.tmp'
+    try:
+        with open(temp_path, 'w') as file:
+            json.dump(indices, file)
+        os.replace(temp_path, index_file)
+    except Exception as e:
+        print('INVENTORY INDEX WRITE FAILED')
+        print(e)
+
+# nodes from the informer cache when it runs (daemon mode), otherwise from one list call
+def discover_nodes(v1):
+    nodes = cluster_cache.get_nodes() if cluster_cache.started else v1.list_node(watch=False).items
+    return [{"name" : node.metadata.name, "address" : node.status.addresses[0].address} for node in nodes]
+
+def load_inventory_file(inventory_path):
+    with open(inventory_path) as file:
+        return json.load(file)["nodes"]
+
+# rebuilds the server list from inventory_path when given, otherwise from the API server
+def refresh(v1, inventory_path=None):
+    global servers, server_addresses, processing_time_overrides
+    nodes = load_inventory_file(inventory_path) if inventory_path else discover_nodes(v1)
+    indices = load_indices()
+    for node in nodes:
+        if node["name"] not in indices:
+            indices[node["name"]] = max(indices.values(), default=-1) + 1
+    save_indices(indices)
+    servers = sorted(({"name" : node["name"], "address" : node["address"], "index" : indices[node["name"]], "memory" : node.get("memory")} for node in nodes),
+    key=lambda server: server["index"])
+    server_addresses = [server["address"] for server in servers]
+    processing_time_overrides = {node["address"] : node["processing_times"] for node in nodes if "processing_times" in node}
+    print('INVENTORY: ' + str(len(servers)) + ' NODES')
+    return servers
+
+def get_server_count():
+    return len(servers)
+
+# node addresses in solver column order
+def get_server_ips():
+    return list(server_addresses)
+
+def get_server_name(column):
+    return servers[column]["name"]
+
+# free memory of the node in a solver column, the value reported by the cluster or else the inventory file's
+def get_memory(available_memory, column):
+    server = servers[column]
+    return available_memory.get(server["address"], server["memory"] if server["memory"] is not None else 0)
+
+# {address : free memory} for every node in the inventory
+def get_memory_table(available_memory):
+    return {server["address"] : get_memory(available_memory, column) for column, server in enumerate(servers)}
+
+# seconds model takes on the node at address, falling back to the slowest profiled node for nodes without a profile
+def get_processing_time(processing_time_table, model, address):
+    if model in processing_time_overrides.get(address, {}):
+        return processing_time_overrides[address][model]
+    times = processing_time_table[model]
+    if address in times:
+        return times[address]
+    return max(times.values())
+
+# processing_time_table completed for every node in the inventory
+def get_processing_time_table(processing_time_table):
+    return {model : {address : get_processing_time(processing_time_table, model, address) for address in get_server_ips()} for model in processing_time_table}
+
+def rtt_row(request):
+    latency = str(request['latency'])
+    unreachable = str(unreachable_rtt)
+    return [latency if address == request['server'] else unreachable for address in server_addresses]
+
+def exec_time_row(processing_time_table, model):
+    return [str(get_processing_time(processing_time_table, model, address)) for address in server_addresses]
+
+def is_server_set_line(line):
+    return '<num_servers>' in line or server_set_pattern.match(line) is not None
+
+# line with its request x server table header rewritten to the inventory's columns, or None for other lines
+def server_columns_line(line):
+    match = server_columns_pattern.match(line)
+    if match is None:
+        return None
+    return match.group(1) + ' ' + ' '.join(str(j) for j in range(len(servers))) + ' :=\n'
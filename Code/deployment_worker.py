@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+
+import background_service_functions
+import cluster_cache
+import phase_metrics
+
+# cold-start deployments requested from the dispatch path
+# each model is created at most once at a time (single-flight) by a background worker
+# while requests for it get an immediate "provisioning" answer with a retry-after hint
+# the hint is the time a cold start takes until its first pod is ready, measured from the
+# request to the pod cache event of a ready pod, less the time the model has already waited
+
+#threads creating deployments
+worker_count = 2
+#seconds a created model keeps answering "provisioning" while its pods get scheduled
+ready_grace_period = 120
+#seconds a cold start is expected to take before any time-to-ready has been measured
+default_retry_after = 30
+#smoothing factor for the time-to-ready used as the retry-after hint
+latency_alpha = 0.3
+
+deployment_queue = queue.Queue()
+state_lock = threading.Lock()
+#model -> monotonic time it was queued, for models queued or being created
+pending = {}
+#model -> monotonic time its creation finished
+recently_created = {}
+#model -> monotonic time it was queued, for created models without a ready pod yet
+awaiting_ready = {}
+deployment_stats = {"requested" : 0, "deduplicated" : 0, "created" : 0, "failed" : 0, "last_ms" : None, "mean_ms" : None, "max_ms" : None,
+"ready" : 0, "ready_last_s" : None, "ready_mean_s" : None}
+started = False
+
+def start_deployment_worker():
+    global started
+    with state_lock:
+        if started:
+            return
+        started = True
+    cluster_cache.add_listener(on_cluster_change)
+    for number in range(worker_count):
+        threading.Thread(target=worker_loop, name='deployment-worker-' + str(number), daemon=True).start()
+
+# seconds until target is expected to be ready, the full expected cold start for a model that is not queued
+def get_retry_after(target=None):
+    expected = default_retry_after if deployment_stats["ready_mean_s"] is None else deployment_stats["ready_mean_s"]
+    queued_at = pending.get(target, awaiting_ready.get(target))
+    if queued_at is not None:
+        expected -= time.monotonic() - queued_at
+    return max(1, int(round(expected)))
+
+# models in created_models with a ready pod in the pod cache
+def ready_models(created_models):
+    ready = set()
+    for currentPod in cluster_cache.get_pods():
+        for model in created_models:
+            if currentPod.metadata.name.startswith(model + '-') and currentPod.status.container_statuses is not None and currentPod.status.container_statuses[0].ready:
+                ready.add(model)
+    return ready
+
+# records the time-to-ready of created models whose pod became ready
+def on_cluster_change(kind, name):
+    if kind != "pods":
+        return
+    with state_lock:
+        now = time.monotonic()
+        for model in list(awaiting_ready):
+            if now - awaiting_ready[model] > ready_grace_period:
+                awaiting_ready.pop(model)
+        if not awaiting_ready or (name is not None and not any(name.startswith(model + '-') for model in awaiting_ready)):
+            return
+        created_models = list(awaiting_ready)
+    ready = ready_models(created_models)
+    with state_lock:
+        for model in ready:
+            queued_at = awaiting_ready.pop(model, None)
+            if queued_at is None:
+                continue
+            elapsed = time.monotonic() - queued_at
+            phase_metrics.record('cold_start_ready', elapsed * 1000)
+            deployment_stats["ready"] += 1
+            deployment_stats["ready_last_s"] = round(elapsed, 2)
+            if deployment_stats["ready_mean_s"] is None:
+                deployment_stats["ready_mean_s"] = elapsed
+            else:
+                deployment_stats["ready_mean_s"] += latency_alpha * (elapsed - deployment_stats["ready_mean_s"])
+
+# queues a deployment of target unless one is already queued, running or just finished
+# returns the retry-after hint in seconds, or None when the model has no deployment file
+def request_deployment(target):
+    with state_lock:
+        created_at = recently_created.get(target)
+        if target in pending or (created_at is not None and time.monotonic() - created_at < ready_grace_period):
+            deployment_stats["deduplicated"] += 1
+            return get_retry_after(target)
+        if not background_service_functions.deployment_file_exists(target):
+            return None
+        pending[target] = time.monotonic()
+        deployment_stats["requested"] += 1
+        retry_after = get_retry_after(target)
+    deployment_queue.put(target)
+    return retry_after
+
+def record_creation(elapsed_ms, success):
+    phase_metrics.record('cold_start_deployment', elapsed_ms)
+    with state_lock:
+        if not success:
+            deployment_stats["failed"] += 1
+            return
+        deployment_stats["created"] += 1
+        deployment_stats["last_ms"] = elapsed_ms
+        if deployment_stats["mean_ms"] is None:
+            deployment_stats["mean_ms"] = elapsed_ms
+        else:
+            deployment_stats["mean_ms"] += latency_alpha * (elapsed_ms - deployment_stats["mean_ms"])
+        if deployment_stats["max_ms"] is None or elapsed_ms > deployment_stats["max_ms"]:
+            deployment_stats["max_ms"] = elapsed_ms
+
+def worker_loop():
+    while True:
+        target = deployment_queue.get()
+        time1 = time.perf_counter()
+        try:
+            success = background_service_functions.create_deployment(target)
+        except Exception as e:
+            print(e)
+            success = False
+        record_creation((time.perf_counter() - time1) * 1000, success)
+        with state_lock:
+            queued_at = pending.pop(target, None)
+            if success:
+                recently_created[target] = time.monotonic()
+                awaiting_ready[target] = queued_at
+        deployment_queue.task_done()
+
+# queue depth, models in flight, creation latency and time-to-ready
+def get_deployment_stats():
+    now = time.monotonic()
+    with state_lock:
+        stats = deployment_stats.copy()
+        stats["queue_depth"] = deployment_queue.qsize()
+        stats["pending"] = {model : now - queued_at for model, queued_at in pending.items()}
+        stats["awaiting_ready"] = {model : now - queued_at for model, queued_at in awaiting_ready.items()}
+        stats["retry_after"] = get_retry_after()
+    return stats
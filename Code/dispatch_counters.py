@@ -0,0 +1,60 @@
+import math
+import threading
+import time
+
+# live load counters per (model, node) kept inside the frontend
+# inflight counts requests currently being served through the frontend,
+# recent is an exponentially decaying count of requests dispatched to the node
+
+#seconds for a dispatched request to count half as much towards recent load
+decay_half_life = 5.0
+
+counters_lock = threading.Lock()
+counters = {}
+
+def get_counter(model, node):
+    key = (model, node)
+    if key not in counters:
+        counters[key] = {"inflight" : 0, "recent" : 0.0, "dispatched" : 0, "updated" : time.monotonic()}
+    return counters[key]
+
+def decay(counter, now):
+    elapsed = now - counter["updated"]
+    if elapsed > 0:
+        counter["recent"] *= math.pow(0.5, elapsed / decay_half_life)
+        counter["updated"] = now
+
+# records that a request for model was sent to node
+def record_dispatch(model, node):
+    with counters_lock:
+        counter = get_counter(model, node)
+        decay(counter, time.monotonic())
+        counter["recent"] += 1
+        counter["dispatched"] += 1
+
+def begin_request(model, node):
+    with counters_lock:
+        get_counter(model, node)["inflight"] += 1
+
+def end_request(model, node):
+    with counters_lock:
+        counter = get_counter(model, node)
+        counter["inflight"] = max(0, counter["inflight"] - 1)
+
+# current load estimate of model on node: requests in flight plus decayed recent dispatches
+def get_load(model, node):
+    with counters_lock:
+        counter = counters.get((model, node))
+        if counter is None:
+            return 0.0
+        decay(counter, time.monotonic())
+        return counter["inflight"] + counter["recent"]
+
+def get_all_counters():
+    now = time.monotonic()
+    result = {}
+    with counters_lock:
+        for (model, node), counter in counters.items():
+            decay(counter, now)
+            result.setdefault(model, {})[node] = {"inflight" : counter["inflight"], "recent" : counter["recent"], "dispatched" : counter["dispatched"]}
+    return result
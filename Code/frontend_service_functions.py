@@ -1,12 +1,22 @@
 from kubernetes import client, config
 from flask import jsonify
 from os import path
-from datetime import datetime
 import yaml
 import json
 import time
 
-import background_service_functions
+import admission_control
+import cluster_cache
+import deployment_worker
+import dispatch_counters
+import load_balancing
+import model_stats_store
+import node_metrics
+import node_scoring
+import phase_metrics
+import request_log
+import routing_table
+import telemetry
 
 #set k8s params
 namespace = 'deployed-services'
@@ -18,14 +28,25 @@ apps_api = client.AppsV1Api()
 deployment = client.V1Deployment()
 custom_obj_api = client.CustomObjectsApi()
 
-# gets the current cpu usage of a node based on the node's name
+#pods, services and endpoints are served from a watch-backed local cache
+cluster_cache.start_cluster_cache(v1)
+deployment_worker.start_deployment_worker()
+routing_table.start_routing_table()
+telemetry.start_telemetry(custom_obj_api)
+
+#'cpu' sends requests to the replica host with the lowest cpu usage
+#'score' ranks replica hosts with the weighted multi-criteria scoring engine
+#'p2c' compares two random replica hosts on live in-flight counts and cpu
+dispatch_policy = 'cpu'
+#reject or redirect dispatches that would miss their latency budget
+admission_control_enabled = False
+
+# gets the smoothed cpu usage (millicores) of a node based on the node's name
 def get_node_cpu_usage(node_name, host_ip, min_cpu_usage_node):
-    try:
-        node = custom_obj_api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes/" + node_name)
-    except Exception as e: 
-        print(e)
+    usage = node_metrics.get_node_usage(custom_obj_api, node_name)
+    if usage is None:
         return None
-    cpu_usage = node['usage']['cpu']
+    cpu_usage = telemetry.get_smoothed_cpu(node_name, usage['cpu'])
     if cpu_usage < min_cpu_usage_node['cpu']:
         min_cpu_usage_node['host'] = host_ip
         min_cpu_usage_node['name'] = node_name
@@ -35,8 +56,7 @@ def get_node_cpu_usage(node_name, host_ip, min_cpu_usage_node):
 
 # gets all the pods serving the target image
 def findPods(target, podList, min_cpu_usage_node):
-    pods = v1.list_namespaced_pod(namespace='deployed-services')
-    for currentPod in pods.items:
+    for currentPod in cluster_cache.get_pods():
         if target + '-' in currentPod.metadata.name:
             print('TARGET ' + target)
             print(currentPod.metadata.name)
@@ -49,132 +69,93 @@ def findPods(target, podList, min_cpu_usage_node):
 # gets the NodePort corresponding to the service
 def findServicePort(target):
     print('SERVICE PORT TARGET ' + target)
-    retService = v1.list_namespaced_service(namespace, watch=False)
-    for currentService in retService.items:
-        curr_service_name = currentService.metadata.name
-        service_name_array = curr_service_name.split('-')
+    with phase_metrics.timed('service_port_lookup'):
+        return cluster_cache.get_service_port(target)
 
-        if target == service_name_array[0]:
-            return currentService.spec.ports[0].node_port
-
-# returns the best node for every service
-def get_best_nodes(model_stats):
-    hostList = {}
+# returns the best node for every service from the materialized routing table
+def get_best_nodes():
     time1 = time.perf_counter()
-    services = v1.list_namespaced_service(namespace, watch=False)
-    for currentService in services.items:
-        #get best nodes specific service expects a dict/json
-        curr_service_name = currentService.metadata.name
-        name_array = curr_service_name.split('-')
-        best_node = get_best_node_specific_service({"model" : name_array[0]}, True, model_stats)
-        
-        if best_node is not None:
-            hostList[name_array[0]] = best_node
-        else:
-            print("Skipping unavailable service")
-    
+    hostList = routing_table.get_routing_table(custom_obj_api, dispatch_policy)
+
     if not hostList: # empty
         return {'N/A' : 'No deployed services'}
     else:
         print(hostList)
-        time2 = time.perf_counter()
-        get_service_time = (time2 - time1) * 1000
-        print("\n\nGet ALL Node Time: " + str(get_service_time) + " ms")
+        phase_metrics.record('routing_table', (time.perf_counter() - time1) * 1000)
         return jsonify(hostList)
 
 # returns the best node for a specific named service
-def get_best_node_specific_service(request_body, all_flag, model_stats):
-    min_cpu_usage_node = {'host':None, 'cpu':"inf"}
+def get_best_node_specific_service(request_body):
+    min_cpu_usage_node = {'host':None, 'cpu':float('inf')}
     podList = []
     target = request_body['model']
     print('\nGET BEST NODE SPECIFIC TARGET ' + target)
     
     time1 = time.perf_counter()
-    findPods(target, podList, min_cpu_usage_node)
-
-    # all_flag means request is coming from the get_best_nodes function
-    if all_flag:
-        if min_cpu_usage_node['host'] == None:
-            return None
+    with phase_metrics.timed('pod_lookup'):
+        findPods(target, podList, min_cpu_usage_node)
+    if dispatch_policy == 'score' and podList:
+        node_scoring.select_node(target, podList, min_cpu_usage_node, custom_obj_api)
+    elif dispatch_policy == 'p2c' and podList:
+        load_balancing.select_node(target, podList, min_cpu_usage_node, custom_obj_api)
+
+    if min_cpu_usage_node['host'] == None:
+        retry_after = deployment_worker.request_deployment(target)
+        if retry_after is not None:
+            update_model_stats(target)
+            return json.dumps({target : "Does not exist, creating new deployment", "retry_after" : retry_after})
         else:
-            if findServicePort(target) is None:
-                return 'Deployment in progress'
-            else:
-                return_obj = min_cpu_usage_node['host'] + ':' + str(findServicePort(target))
-
-
-                return return_obj
+            return json.dumps({target : "Unknown Service"})
     else:
-        if min_cpu_usage_node['host'] == None:
-            deployment_result = background_service_functions.create_deployment(target)
-            if deployment_result:
-                update_model_stats(target, model_stats)
-                return json.dumps({target : "Does not exist, creating new deployment"})
-            else:
-                return json.dumps({target : "Unknown Service"})
+        service_port = findServicePort(target)
+        if service_port is None:
+            update_model_stats(target)
+            return json.dumps({target : 'Deployment in progress'})
+        elif admission_control_enabled and not admission_control.admit(target, podList, min_cpu_usage_node, request_body['latency']):
+            update_model_stats(target)
+            return json.dumps({target : 'Overloaded', "retry_after" : 1})
         else:
-            if findServicePort(target) is None:
-                update_model_stats(target, model_stats)
-                return json.dumps({target : 'Deployment in progress'})
-            else:
-                result_json = json.dumps({target : min_cpu_usage_node['host'] + ':' + str(findServicePort(target))})
-                time2 = time.perf_counter()
-                get_service_time = (time2 - time1) * 1000
-                print("\n\nGet SPECIFIC Node Time: " + str(get_service_time) + " ms")
-
-                update_model_stats(target, model_stats)
-                print(update_request_stats(target, request_body['latency'], min_cpu_usage_node['host'], min_cpu_usage_node['name']))
-                return result_json
+            result_json = json.dumps({target : min_cpu_usage_node['host'] + ':' + str(service_port)})
+            get_service_time = (time.perf_counter() - time1) * 1000
+            phase_metrics.record('route_lookup', get_service_time)
+            cluster_cache.record_route_lookup(get_service_time)
+
+            update_model_stats(target)
+            dispatch_counters.record_dispatch(target, min_cpu_usage_node['name'])
+            node_scoring.record_rtt(min_cpu_usage_node['host'], request_body['latency'])
+            print(update_request_stats(target, request_body['latency'], min_cpu_usage_node['host'], min_cpu_usage_node['name']))
+            return result_json
 
 def set_model_stats(new_model_stats):
-    with open('model_stats.json', 'w') as save_file:
-        json.dump(new_model_stats, save_file)
-    save_file.close()
+    model_stats_store.set_model_stats(new_model_stats)
 
-def update_model_stats(target, model_stats):
-    num_requests = None
-    try:
-        num_requests = model_stats[target]['num_requests']
-    except:
-        num_requests = 0
-    model_stats[target] = {"last_request" : datetime.strftime(datetime.now(), '%m/%d/%y %H:%M:%S'), "num_requests" : num_requests + 1}
+def update_model_stats(target):
     print(target)
-    print(model_stats[target])
+    with phase_metrics.timed('model_stats_update'):
+        print(model_stats_store.record_request(target))
 
 def update_request_stats(model_requested, latency_value, server_recommended, server_name):
-    request_stats = {}
-    file = None
-
     try:
-        file = open('request_stats.json')
-        request_stats = json.load(file)
-        file.close()
-    except:
-        print('CANT OPEN FILE REQUEST STATS')
+        with phase_metrics.timed('request_log_append'):
+            request_log.append_request(model_requested, latency_value, server_recommended, server_name)
+    except Exception as e:
+        print('CANT WRITE REQUEST LOG')
+        print(e)
         return False
-
-    request_count = len(request_stats)-1
-    if request_count == 0:
-        request_stats[request_count] = {"model" : model_requested, "latency" : latency_value, "server" : server_recommended, "server_name" : server_name}
-    request_stats[request_count + 1] = {"model" : model_requested, "latency" : latency_value, "server" : server_recommended, "server_name" : server_name}
-
-    with open('request_stats.json', 'w') as save_file:
-        json.dump(request_stats, save_file)
-    save_file.close()
-
     return True
 
+# free memory (Ki) of every node keyed by address, smoothed over the telemetry history
 def get_current_server_memory():
     server_memory = {}
     try:
-        nodes_total = v1.list_node(watch=False)
-        nodes_usage = custom_obj_api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes")
-        #using a counter avoids nested loop
-        count = 0
-        for node in nodes_total.items:
-            total_mem = node.status.allocatable['memory'][0 : len(node.status.allocatable['memory']) - 2]
-            consumed_mem = nodes_usage['items'][count]['usage']['memory'][0 : len(nodes_usage['items'][count]['usage']['memory']) - 2]
-            server_memory[node.status.addresses[0].address] = int(total_mem) - int(consumed_mem)
+        usage = node_metrics.get_snapshot(custom_obj_api)
+        for node in cluster_cache.get_nodes():
+            name = node.metadata.name
+            free_mem = telemetry.get_smoothed_free_memory(name)
+            if free_mem is None and name in usage:
+                free_mem = node_metrics.parse_memory(node.status.allocatable['memory']) - usage[name]['memory']
+            if free_mem is not None:
+                server_memory[node.status.addresses[0].address] = int(free_mem // 1024)
         return jsonify(server_memory)
     except Exception as e: 
         print(e)
\ No newline at end of file
@@ -0,0 +1,126 @@
+import json
+import os
+
+import request_classes
+
+# incremental provisioning: only models whose request-class demand moved since the last
+# solved cycle are re-optimized, every other model keeps its previous rows and servers
+# pinned, with their memory reserved, and the previous placement warm-starts the solver
+# the last solved summary, rows and placement are kept in state_file between cycles, and
+# only saved once the cycle's provisioning succeeded, so a model whose rollout failed is
+# re-solved in the next cycle
+
+state_file = 'last_solve.json'
+#share of a model's previous requests that must move (L1 over its classes) before it is re-solved
+demand_change_threshold = 0.2
+
+#models re-solved in the current cycle, all models when there is no previous state
+last_changed = None
+#state of the current cycle, saved by save_pending after provisioning succeeded
+pending_state = None
+
+def load_state():
+    try:
+        with open(state_file) as file:
+            return json.load(file)
+    except Exception:
+        return {"summary" : {}, "rows" : {}, "placement" : {}}
+
+def save_state(state):
+    temp_path = state_file + '.tmp'
+    try:
+        with open(temp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(temp_path, state_file)
+    except Exception as e:
+        print('INCREMENTAL STATE WRITE FAILED')
+        print(e)
+
+def class_id(request_class):
+    return request_class['model'] + '|' + request_class['server'] + '|' + str(request_classes.class_key(request_class)[2])
+
+# {model : {class id : weight}}, unweighted rows of the same class are counted together
+def demand_summary(classes):
+    summary = {}
+    for c in range(len(classes)):
+        request_class = classes[str(c)]
+        model_summary = summary.setdefault(request_class['model'], {})
+        model_summary[class_id(request_class)] = model_summary.get(class_id(request_class), 0) + request_class.get('weight', 1)
+    return summary
+
+def demand_changed(current, previous):
+    if previous is None or set(current) != set(previous):
+        return True
+    moved = sum(abs(current[key] - previous[key]) for key in current)
+    return moved > demand_change_threshold * sum(previous.values())
+
+# models whose demand changed, plus those in missing
+def changed_models(summary, state, missing=()):
+    global last_changed
+    last_changed = {model for model in summary if model in missing or demand_changed(summary[model], state["summary"].get(model))}
+    return last_changed
+
+# models with a previous server that has no deployment of the model any more, current is a set of (model, server ip)
+def missing_models(state, current):
+    return {model for model, server_ips in state["placement"].items() if any((model, ip) not in current for ip in server_ips)}
+
+# classes of the changed models renumbered from 0, plus their indices in classes
+def select_classes(classes, changed):
+    indices = [c for c in range(len(classes)) if classes[str(c)]['model'] in changed]
+    return {str(position) : classes[str(c)] for position, c in enumerate(indices)}, indices
+
+# node memory left once every pinned model keeps its previous servers, for node_mem that is
+# total capacity rather than free memory the pinned deployments already use
+def reserve_pinned(node_mem, state, changed, memory_requirements, memory_unit):
+    reserved = dict(node_mem)
+    for model, server_ips in state["placement"].items():
+        if model not in changed and model in memory_requirements:
+            for ip in server_ips:
+                if ip in reserved:
+                    reserved[ip] -= memory_requirements[model] * memory_unit
+    return reserved
+
+# previous servers of the changed models, {model : [server ip]}
+def warm_start(state, changed):
+    return {model : server_ips for model, server_ips in state["placement"].items() if model in changed}
+
+# combines the new rows of the changed classes with the pinned rows of the rest, keeps the new state for save_pending
+def merge(classes, summary, indices, active_results, state, server_ips):
+    global pending_state
+    class_results = [None] * len(classes)
+    for position, c in enumerate(indices):
+        class_results[c] = active_results[position] if position < len(active_results) else [0] * len(server_ips)
+    for c in range(len(classes)):
+        if class_results[c] is None:
+            class_results[c] = state["rows"].get(class_id(classes[str(c)]), [0] * len(server_ips))
+
+    placement = {}
+    rows = {}
+    for c in range(len(classes)):
+        rows[class_id(classes[str(c)])] = class_results[c]
+        servers = placement.setdefault(classes[str(c)]['model'], [])
+        for j, value in enumerate(class_results[c]):
+            if value == 1 and server_ips[j] not in servers:
+                servers.append(server_ips[j])
+    pending_state = {"summary" : summary, "rows" : rows, "placement" : placement}
+    return class_results
+
+# saves the state of the current cycle, called once its provisioning succeeded
+def save_pending():
+    global pending_state
+    if pending_state is not None:
+        save_state(pending_state)
+        pending_state = None
+
+# drops a model from the state so the next cycle re-solves it, e.g. after its deployment was removed
+def forget_model(model):
+    state = load_state()
+    if model in state["summary"]:
+        state["summary"].pop(model)
+        state["placement"].pop(model, None)
+        save_state(state)
+
+# request stats and solver rows of the changed models only, renumbered from 0 for perform_provisioning
+def restrict(request_stats, solver_results, changed):
+    indices = [i for i in range(len(solver_results)) if request_stats[str(i)]['model'] in changed]
+    return {str(position) : request_stats[str(i)] for position, i in enumerate(indices)}, [solver_results[i] for i in indices]
@@ -0,0 +1,47 @@
+import random
+
+import cluster_cache
+import dispatch_counters
+import node_metrics
+import telemetry
+
+# power-of-two-choices replica selection
+# two random replica hosts are compared on the frontend's live in-flight and recently
+# dispatched counts plus the cpu snapshot, so a burst spreads out between metrics
+# refreshes instead of piling onto the single lowest-cpu host
+
+#cost of one in-flight or recently dispatched request, in cpu cores
+load_weight = 1.0
+
+rng = random.Random()
+
+# lower is better, cpu is converted from millicores to cores
+def candidate_cost(load, cpu_millicores):
+    return load * load_weight + cpu_millicores / 1000
+
+# picks the cheaper of two random candidates, load_of and cpu_of map a candidate to its load and cpu
+def pick_two_choices(candidates, load_of, cpu_of, random_source=rng):
+    if len(candidates) == 1:
+        return candidates[0]
+    first, second = random_source.sample(candidates, 2)
+    if candidate_cost(load_of(second), cpu_of(second)) < candidate_cost(load_of(first), cpu_of(first)):
+        return second
+    return first
+
+# picks a host for model among candidate_ips and records it in best_node like get_node_cpu_usage does
+def select_node(model, candidate_ips, best_node, custom_obj_api):
+    usage = node_metrics.get_snapshot(custom_obj_api)
+    names = {}
+    for node in cluster_cache.get_nodes():
+        for address in node.status.addresses:
+            if address.address in candidate_ips:
+                names[address.address] = node.metadata.name
+    hosts = [ip for ip in candidate_ips if names.get(ip) in usage]
+    if not hosts:
+        return None
+    cpu = {ip : telemetry.get_smoothed_cpu(names[ip], usage[names[ip]]['cpu']) for ip in hosts}
+    host = pick_two_choices(hosts, lambda ip: dispatch_counters.get_load(model, names[ip]), lambda ip: cpu[ip])
+    best_node['host'] = host
+    best_node['name'] = names[host]
+    best_node['cpu'] = cpu[host]
+    return best_node
@@ -0,0 +1,61 @@
+import threading
+
+import yaml
+
+# deployment and service manifests rendered in memory from the deployment_files templates
+# each template is parsed once with sentinel values on its placeholder lines (written with
+# the indentation the placeholders stand for in the templates) and cached,
+# every (model, node) manifest is a copy of the parsed dict with the sentinels replaced
+
+template_dir = 'deployment_files/'
+
+node_sentinel = '__node_name__'
+app_sentinel = '__app_name__'
+name_sentinel = '__object_name__'
+
+#placeholder -> replacement line per template kind, in the order the generators check them
+placeholder_lines = {"deployment" : [('<node-name>', "      nodeName: " + node_sentinel + "\n"), ('<app-name>', "      app: " + app_sentinel + "\n"),
+("<app-name-template>", "        app: " + app_sentinel + "\n"), ('<deployment-name>', "  name: " + name_sentinel + "\n")],
+"service" : [('<service-name>', "  name: " + name_sentinel + "\n"), ('<deployment-name>', "    app: " + app_sentinel + "\n")]}
+
+cache_lock = threading.Lock()
+parsed_templates = {}
+
+def parse_template(model, kind):
+    lines = []
+    with open(template_dir + model + "-" + kind + "-template.yaml", "r") as template:
+        for line in template:
+            for placeholder, replacement in placeholder_lines[kind]:
+                if placeholder in line:
+                    line = replacement
+                    break
+            lines.append(line)
+    return yaml.safe_load("".join(lines))
+
+# parsed template of model for kind ("deployment" or "service"), read from disk only the first time
+def get_template(model, kind):
+    with cache_lock:
+        if (model, kind) not in parsed_templates:
+            parsed_templates[(model, kind)] = parse_template(model, kind)
+        return parsed_templates[(model, kind)]
+
+# copy of item with every sentinel string replaced by its value
+def substitute(item, values):
+    if isinstance(item, dict):
+        return {key : substitute(value, values) for key, value in item.items()}
+    if isinstance(item, list):
+        return [substitute(value, values) for value in item]
+    return values.get(item, item) if isinstance(item, str) else item
+
+def render_deployment(model, server_name):
+    app = model + "-" + server_name
+    return substitute(get_template(model, "deployment"), {node_sentinel : server_name, app_sentinel : app, name_sentinel : app + "-deployment"})
+
+def render_service(model, server_name):
+    app = model + "-" + server_name
+    return substitute(get_template(model, "service"), {app_sentinel : app, name_sentinel : app})
+
+# drops the cached templates, e.g. after the files under deployment_files/ changed
+def clear_cache():
+    with cache_lock:
+        parsed_templates.clear()
@@ -0,0 +1,52 @@
+import json
+import os
+import re
+from datetime import datetime
+
+# versioned model profiles written by profile_models.py, model_profiles/profile-v<N>.json
+# {"version" : N, "created" : str, "processing_time" : {model : {address : p50 seconds}},
+# "processing_time_p95" : {model : {address : seconds}}, "memory" : {model : peak MiB}}
+# the newest profile is merged over the hand-typed tables when provisioning and dispatch start
+
+profile_dir = 'model_profiles'
+
+def profile_path(version):
+    return os.path.join(profile_dir, 'profile-v' + str(version) + '.json')
+
+def latest_version():
+    versions = [int(match.group(1)) for match in (re.fullmatch(r'profile-v(\d+)\.json', name) for name in os.listdir(profile_dir)) if match] if os.path.isdir(profile_dir) else []
+    return max(versions, default=None)
+
+# the given or newest profile, None when there is none
+def load_profile(version=None):
+    version = latest_version() if version is None else version
+    if version is None:
+        return None
+    with open(profile_path(version)) as file:
+        return json.load(file)
+
+# writes profile as the next version and returns that version
+def save_profile(profile):
+    os.makedirs(profile_dir, exist_ok=True)
+    version = (latest_version() or 0) + 1
+    profile = dict(profile, version=version, created=datetime.now().strftime('%m/%d/%y %H:%M:%S'))
+    with open(profile_path(version) + '.tmp', 'w') as file:
+        json.dump(profile, file, indent=1)
+    os.replace(profile_path(version) + '.tmp', profile_path(version))
+    return version
+
+# updates the tables in place from the newest profile, pairs it did not measure keep their values
+def apply_profile(processing_time_table, memory_requirements_table):
+    try:
+        profile = load_profile()
+    except Exception as e:
+        print('CANT LOAD MODEL PROFILE')
+        print(e)
+        return None
+    if profile is None:
+        return None
+    for model, times in profile.get("processing_time", {}).items():
+        processing_time_table.setdefault(model, {}).update(times)
+    memory_requirements_table.update(profile.get("memory", {}))
+    print('LOADED MODEL PROFILE v' + str(profile["version"]) + ' (' + profile["created"] + ')')
+    return profile["version"]
@@ -0,0 +1,105 @@
+import atexit
+import copy
+import json
+import os
+import tempfile
+import threading
+from datetime import datetime
+
+# in-process model stats, {model : {"last_request" : str, "num_requests" : int}}
+# requests update memory only, a background thread writes the file behind them
+
+stats_file = 'model_stats.json'
+#seconds between background flushes
+flush_interval = 5.0
+#number of unflushed updates that triggers an early flush
+dirty_threshold = 100
+
+store_lock = threading.Lock()
+flush_lock = threading.Lock()
+flush_event = threading.Event()
+model_stats = {}
+dirty_count = 0
+started = False
+
+def load_model_stats():
+    global model_stats
+    try:
+        with open(stats_file) as file:
+            loaded = json.load(file)
+    except Exception as e:
+        print('Unable to Open File')
+        loaded = {}
+    with store_lock:
+        model_stats = loaded
+
+# loads the last flushed stats and starts the write-behind thread, safe to call more than once
+def start_model_stats_store():
+    global started
+    with store_lock:
+        if started:
+            return
+        started = True
+    load_model_stats()
+    threading.Thread(target=flush_loop, name='model-stats-flush', daemon=True).start()
+    atexit.register(flush)
+
+def mark_dirty():
+    global dirty_count
+    dirty_count += 1
+    if dirty_count >= dirty_threshold:
+        flush_event.set()
+
+# counts one request for the target model, returns its updated entry
+def record_request(target):
+    with store_lock:
+        entry = model_stats.setdefault(target, {"num_requests" : 0})
+        entry["num_requests"] = entry.get("num_requests", 0) + 1
+        entry["last_request"] = datetime.strftime(datetime.now(), '%m/%d/%y %H:%M:%S')
+        mark_dirty()
+        return entry.copy()
+
+def get_model_stats():
+    with store_lock:
+        return copy.deepcopy(model_stats)
+
+def set_model_stats(new_model_stats):
+    global model_stats
+    with store_lock:
+        model_stats = copy.deepcopy(new_model_stats)
+        mark_dirty()
+    flush_event.set()
+
+# writes the stats to a temp file in the same directory then renames it over the old file
+# so a crash mid-write never leaves a truncated model_stats.json behind
+def flush():
+    global dirty_count
+    with flush_lock:
+        with store_lock:
+            if dirty_count == 0:
+                return False
+            data = json.dumps(model_stats)
+            flushed_count = dirty_count
+        directory = os.path.dirname(os.path.abspath(stats_file))
+        fd, temp_path = tempfile.mkstemp(prefix='.model_stats-', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, stats_file)
+        except Exception as e:
+            print('MODEL STATS FLUSH FAILED')
+            print(e)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        with store_lock:
+            dirty_count -= flushed_count
+        return True
+
+def flush_loop():
+    while True:
+        flush_event.wait(flush_interval)
+        flush_event.clear()
+        flush()
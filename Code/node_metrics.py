@@ -0,0 +1,80 @@
+import threading
+import time
+
+import phase_metrics
+
+# one cluster-wide node metrics snapshot shared by every dispatch decision
+# refreshed with a single metrics.k8s.io "nodes" call at most once per ttl
+
+#seconds a snapshot is reused before it is fetched again
+snapshot_ttl = 2.0
+
+snapshot_lock = threading.Lock()
+snapshot = {"nodes" : {}, "fetched_at" : None}
+snapshot_stats = {"fetches" : 0, "hits" : 0, "errors" : 0}
+
+cpu_suffixes = {"n" : 1e-6, "u" : 1e-3, "m" : 1.0}
+memory_suffixes = {"Ki" : 1024, "Mi" : 1024 ** 2, "Gi" : 1024 ** 3, "Ti" : 1024 ** 4,
+"k" : 1000, "M" : 1000 ** 2, "G" : 1000 ** 3, "T" : 1000 ** 4}
+
+def set_snapshot_ttl(ttl):
+    global snapshot_ttl
+    snapshot_ttl = float(ttl)
+
+# converts a kubernetes cpu quantity ("250m", "123456789n", "2") to millicores
+def parse_cpu(quantity):
+    quantity = str(quantity)
+    if quantity[-1:] in cpu_suffixes:
+        return float(quantity[:-1]) * cpu_suffixes[quantity[-1]]
+    return float(quantity) * 1000
+
+# converts a kubernetes memory quantity ("1024Ki", "2Gi", "512") to bytes
+def parse_memory(quantity):
+    quantity = str(quantity)
+    if quantity[-2:] in memory_suffixes:
+        return int(float(quantity[:-2]) * memory_suffixes[quantity[-2:]])
+    if quantity[-1:] in memory_suffixes:
+        return int(float(quantity[:-1]) * memory_suffixes[quantity[-1]])
+    return int(float(quantity))
+
+def fetch_snapshot(custom_obj_api):
+    with phase_metrics.timed('metrics_fetch'):
+        usage = custom_obj_api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes")
+    nodes = {}
+    for item in usage['items']:
+        nodes[item['metadata']['name']] = {"cpu" : parse_cpu(item['usage']['cpu']), "memory" : parse_memory(item['usage']['memory'])}
+    return nodes
+
+# gets the usage of every node, {node_name : {"cpu" : millicores, "memory" : bytes}}
+def get_snapshot(custom_obj_api):
+    with snapshot_lock:
+        now = time.monotonic()
+        if snapshot["fetched_at"] is not None and now - snapshot["fetched_at"] < snapshot_ttl:
+            snapshot_stats["hits"] += 1
+            return snapshot["nodes"]
+        try:
+            snapshot["nodes"] = fetch_snapshot(custom_obj_api)
+            snapshot_stats["fetches"] += 1
+        except Exception as e:
+            #keep serving the last snapshot rather than failing every dispatch
+            print(e)
+            snapshot_stats["errors"] += 1
+        snapshot["fetched_at"] = now
+        return snapshot["nodes"]
+
+# gets the usage of one node from the shared snapshot, None if the node reports no metrics
+def get_node_usage(custom_obj_api, node_name):
+    return get_snapshot(custom_obj_api).get(node_name)
+
+# monotonic time the current snapshot was fetched, changes on every refresh
+def get_snapshot_time():
+    with snapshot_lock:
+        return snapshot["fetched_at"]
+
+def get_snapshot_stats():
+    with snapshot_lock:
+        stats = snapshot_stats.copy()
+        stats["ttl"] = snapshot_ttl
+        stats["age"] = None if snapshot["fetched_at"] is None else time.monotonic() - snapshot["fetched_at"]
+        stats["nodes"] = len(snapshot["nodes"])
+    return stats
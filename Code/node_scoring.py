@@ -0,0 +1,147 @@
+import numpy as np
+import threading
+
+import background_service_functions
+import cluster_cache
+import dispatch_counters
+import node_metrics
+
+# multi-criteria replica scoring for dispatch
+# node features are kept as arrays indexed by node so every candidate replica
+# of a model is scored in one vectorized pass, lowest score wins
+# each feature is put on a fixed scale before weighting, not on the spread of the current
+# candidates, so the score reflects how far apart two replicas are: cpu and memory as the
+# used share of the node, processing time as a share of the model's slowest node, and rtt
+# and in-flight requests in units of feature_scales
+
+feature_names = ["cpu", "free_memory", "processing_time", "rtt", "inflight"]
+#relative importance of each feature, a weight of 0 ignores the feature
+score_weights = {"cpu" : 1.0, "free_memory" : 0.5, "processing_time" : 2.0, "rtt" : 1.0, "inflight" : 1.0}
+#value of a feature that counts as 1, for the features without a natural scale
+feature_scales = {"rtt" : 1.0, "inflight" : 4.0}
+#smoothing factor for the observed client rtt of each node
+rtt_alpha = 0.2
+#added to the score of nodes whose free memory (MiB) is below the model's requirement
+memory_pressure_penalty = 10.0
+
+features_lock = threading.Lock()
+node_names = []
+node_index = {}
+ip_to_node = {}
+model_index = {}
+cpu = np.zeros(0)
+cpu_capacity = np.zeros(0)
+free_memory = np.zeros(0)
+memory_capacity = np.zeros(0)
+rtt = np.zeros(0)
+processing_time = np.zeros((0, 0))
+memory_requirements = np.zeros(0)
+features_version = None
+
+def set_score_weights(new_weights):
+    for name in new_weights:
+        if name not in score_weights:
+            raise ValueError('Unknown scoring feature: ' + name)
+    score_weights.update({name : float(weight) for name, weight in new_weights.items()})
+
+def get_score_weights():
+    return score_weights.copy()
+
+def weight_vector():
+    return np.array([score_weights[name] for name in feature_names])
+
+def get_internal_ip(node):
+    for address in node.status.addresses:
+        if address.type == 'InternalIP':
+            return address.address
+    return node.status.addresses[0].address
+
+# model x node processing time matrix, unprofiled nodes get the model's mean time
+def build_processing_time_matrix(ips):
+    matrix = np.full((len(background_service_functions.processing_time_table), len(ips)), np.nan)
+    for model, row in model_index.items():
+        times = background_service_functions.processing_time_table[model]
+        for column, ip in enumerate(ips):
+            if ip in times:
+                matrix[row, column] = times[ip]
+        known = matrix[row][~np.isnan(matrix[row])]
+        matrix[row][np.isnan(matrix[row])] = known.mean() if known.size else 0.0
+    return matrix
+
+# rebuilds the node index when the node set changes and the load arrays when the metrics snapshot changes
+def refresh_features(custom_obj_api):
+    global node_names, node_index, ip_to_node, model_index, cpu, cpu_capacity, free_memory, memory_capacity, rtt, processing_time, memory_requirements, features_version
+    usage = node_metrics.get_snapshot(custom_obj_api)
+    version = (cluster_cache.get_version("nodes"), node_metrics.get_snapshot_time())
+    with features_lock:
+        if version == features_version:
+            return
+        nodes = sorted(cluster_cache.get_nodes(), key=lambda node: node.metadata.name)
+        names = [node.metadata.name for node in nodes]
+        if names != node_names:
+            previous_rtt = {name : rtt[index] for name, index in node_index.items()}
+            node_names = names
+            node_index = {name : index for index, name in enumerate(names)}
+            ip_to_node = {get_internal_ip(node) : node.metadata.name for node in nodes}
+            model_index = {model : index for index, model in enumerate(background_service_functions.processing_time_table)}
+            processing_time = build_processing_time_matrix([get_internal_ip(node) for node in nodes])
+            memory_requirements = np.array([background_service_functions.memory_requirements_table.get(model, 0) for model in model_index], dtype=float)
+            rtt = np.array([previous_rtt.get(name, np.nan) for name in names])
+        allocatable = np.array([node_metrics.parse_memory(node.status.allocatable['memory']) for node in nodes], dtype=float)
+        memory_capacity = np.maximum(allocatable, 1)
+        cpu_capacity = np.array([max(node_metrics.parse_cpu(node.status.allocatable['cpu']), 1) for node in nodes], dtype=float)
+        cpu = np.array([usage[name]['cpu'] if name in usage else np.nan for name in names])
+        #nodes missing from the snapshot are treated as the busiest node
+        cpu[np.isnan(cpu)] = np.nanmax(cpu) if not np.isnan(cpu).all() else 0.0
+        used = np.array([usage[name]['memory'] if name in usage else 0 for name in names], dtype=float)
+        free_memory = allocatable - used
+        features_version = version
+
+# folds a client reported latency into the node's smoothed rtt
+def record_rtt(host_ip, latency):
+    with features_lock:
+        if host_ip not in ip_to_node:
+            return
+        index = node_index[ip_to_node[host_ip]]
+        if np.isnan(rtt[index]):
+            rtt[index] = float(latency)
+        else:
+            rtt[index] += rtt_alpha * (float(latency) - rtt[index])
+
+# scores every candidate host serving model in one pass, returns (host_ips, scores)
+def score_candidates(model, candidate_ips, custom_obj_api):
+    refresh_features(custom_obj_api)
+    with features_lock:
+        hosts = [ip for ip in candidate_ips if ip in ip_to_node]
+        if not hosts:
+            return [], np.zeros(0)
+        index = np.array([node_index[ip_to_node[ip]] for ip in hosts])
+        features = np.empty((len(hosts), len(feature_names)))
+        features[:, 0] = cpu[index] / cpu_capacity[index]
+        #more free memory is better, so the used share counts
+        features[:, 1] = 1 - free_memory[index] / memory_capacity[index]
+        if model in model_index:
+            times = processing_time[model_index[model]]
+            features[:, 2] = times[index] / times.max() if times.max() > 0 else 0.0
+        else:
+            features[:, 2] = 0.0
+        features[:, 3] = rtt[index] / feature_scales["rtt"]
+        features[:, 4] = [dispatch_counters.get_load(model, node_names[i]) / feature_scales["inflight"] for i in index]
+        #nodes without an rtt sample yet are treated as average
+        observed = features[:, 3][~np.isnan(features[:, 3])]
+        features[:, 3][np.isnan(features[:, 3])] = observed.mean() if observed.size else 0.0
+        scores = features @ weight_vector()
+        if model in model_index:
+            scores[free_memory[index] < memory_requirements[model_index[model]] * 1024 ** 2] += memory_pressure_penalty
+    return hosts, scores
+
+# picks the lowest scoring candidate and records it in best_node like get_node_cpu_usage does
+def select_node(model, candidate_ips, best_node, custom_obj_api):
+    hosts, scores = score_candidates(model, candidate_ips, custom_obj_api)
+    if not hosts:
+        return None
+    best = int(np.argmin(scores))
+    best_node['host'] = hosts[best]
+    best_node['name'] = ip_to_node[hosts[best]]
+    best_node['score'] = float(scores[best])
+    return best_node
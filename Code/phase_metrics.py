@@ -0,0 +1,125 @@
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+# low overhead latency histograms for every dispatch and provisioning phase
+# values are recorded in microseconds into log-linear (HDR style) buckets:
+# every power of two range is split into equal sub-buckets, so percentiles
+# stay within 1 / sub_bucket_half of the true value at any magnitude
+
+#sub-buckets per power of two is 2 ** (sub_bucket_bits - 1), 8 bits is under 1% error (1 / 128)
+sub_bucket_bits = 8
+#largest recordable value is 2 ** max_value_bits microseconds (about 19 hours)
+max_value_bits = 36
+
+sub_bucket_half = 1 << (sub_bucket_bits - 1)
+bucket_count = (max_value_bits - sub_bucket_bits + 2) * sub_bucket_half
+max_value = (1 << max_value_bits) - 1
+
+histograms_lock = threading.Lock()
+histograms = {}
+
+def bucket_index(value):
+    exponent = max(0, value.bit_length() - sub_bucket_bits)
+    return exponent * sub_bucket_half + (value >> exponent)
+
+# highest value that falls into the bucket
+def bucket_value(index):
+    if index < 2 * sub_bucket_half:
+        return index
+    exponent = index // sub_bucket_half - 1
+    return ((index - exponent * sub_bucket_half + 1) << exponent) - 1
+
+class Histogram:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = array('q', [0]) * bucket_count
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = 0
+
+    def record(self, value):
+        value = min(max(int(value), 0), max_value)
+        with self.lock:
+            self.counts[bucket_index(value)] += 1
+            self.total += 1
+            self.sum += value
+            if self.min is None or value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, quantile):
+        with self.lock:
+            if self.total == 0:
+                return None
+            target = max(1, int(round(quantile * self.total)))
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= target:
+                    return min(bucket_value(index), self.max)
+        return self.max
+
+    def export(self):
+        with self.lock:
+            return {"counts" : {index : count for index, count in enumerate(self.counts) if count}, "sum" : self.sum, "min" : self.min, "max" : self.max}
+
+    def merge(self, exported):
+        with self.lock:
+            for index, count in exported["counts"].items():
+                self.counts[int(index)] += count
+                self.total += count
+            self.sum += exported["sum"]
+            if exported["min"] is not None and (self.min is None or exported["min"] < self.min):
+                self.min = exported["min"]
+            self.max = max(self.max, exported["max"])
+
+def get_histogram(phase):
+    with histograms_lock:
+        if phase not in histograms:
+            histograms[phase] = Histogram()
+        return histograms[phase]
+
+def record(phase, elapsed_ms):
+    get_histogram(phase).record(elapsed_ms * 1000)
+
+# times the body of a with block into the phase's histogram
+@contextmanager
+def timed(phase):
+    time1 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, (time.perf_counter() - time1) * 1000)
+
+def to_ms(value):
+    return None if value is None else value / 1000
+
+# count, mean and p50/p95/p99/max in milliseconds for every phase
+def get_summary():
+    with histograms_lock:
+        phases = dict(histograms)
+    summary = {}
+    for phase, histogram in sorted(phases.items()):
+        if histogram.total == 0:
+            continue
+        summary[phase] = {"count" : histogram.total, "mean_ms" : to_ms(histogram.sum / histogram.total),
+        "min_ms" : to_ms(histogram.min), "p50_ms" : to_ms(histogram.percentile(0.50)), "p95_ms" : to_ms(histogram.percentile(0.95)),
+        "p99_ms" : to_ms(histogram.percentile(0.99)), "max_ms" : to_ms(histogram.max)}
+    return summary
+
+# raw bucket counts of every phase, used to ship histograms from the provisioning process to the server
+def export_histograms(reset=False):
+    global histograms
+    with histograms_lock:
+        phases = histograms
+        if reset:
+            histograms = {}
+    return {phase : histogram.export() for phase, histogram in phases.items() if histogram.total > 0}
+
+def merge_histograms(exported):
+    for phase, data in exported.items():
+        get_histogram(phase).merge(data)
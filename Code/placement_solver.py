@@ -0,0 +1,154 @@
+import time
+
+import numpy as np
+
+try:
+    from scipy.optimize import linprog
+    from scipy.sparse import coo_matrix
+except ImportError:
+    linprog = None
+
+# in-memory placement and dispatch solver, an alternative to the AMPL file round trip
+# request i of model m goes to exactly one server j at cost rtt[i,j] + exec_time[i,j],
+# with rtt 9999 off the request's origin server as in build_data_file, and every model
+# placed on a server takes memory_requirements_table[m] of that server's free memory
+# rows may be weighted request classes (see request_classes), a row's cost counts weight times
+# a greedy placement is compared against the rounded LP relaxation (when scipy is
+# installed) and the cheaper one is returned as the same 0/1 matrix AMPL produces
+
+#rtt used for servers a request did not come from, as written by build_data_file
+unreachable_rtt = 9999
+#Ki of node memory per unit of memory_requirements_table (MiB)
+memory_requirement_unit = 1024
+#the LP relaxation is skipped above this many request (or request class) rows
+lp_max_requests = 2000
+
+solver_stats = {}
+
+# arrays for the placement problem, servers ordered by their index in server_ips
+def build_problem(request_stats, available_memory, memory_requirements, processing_times, server_ips):
+    requests = [request_stats[str(i)] for i in range(len(request_stats))]
+    server_index = {ip : j for j, ip in enumerate(server_ips)}
+    models = sorted({request['model'] for request in requests})
+    model_index = {model : m for m, model in enumerate(models)}
+    exec_time = np.array([[processing_times[model][ip] for ip in server_ips] for model in models], dtype=float)
+
+    request_model = np.array([model_index[request['model']] for request in requests], dtype=int)
+    weight = np.array([float(request.get('weight', 1)) for request in requests])
+    rtt = np.full((len(requests), len(server_ips)), float(unreachable_rtt))
+    for i, request in enumerate(requests):
+        if request['server'] in server_index:
+            rtt[i, server_index[request['server']]] = float(request['latency'])
+
+    return {"models" : models, "request_model" : request_model, "weight" : weight, "cost" : rtt + exec_time[request_model],
+    "memory_requirement" : np.array([memory_requirements[model] * memory_requirement_unit for model in models], dtype=float),
+    "capacity" : np.array([float(available_memory.get(ip, 0)) for ip in server_ips])}
+
+# opens (model, server) pairs in decreasing priority while memory lasts, then opens the
+# cheapest fitting server for every model left without one
+def open_servers(problem, priority):
+    model_count, server_count = priority.shape
+    remaining = problem["capacity"].copy()
+    opened = np.zeros((model_count, server_count), dtype=bool)
+    for flat in np.argsort(-priority, axis=None, kind='stable'):
+        m, j = divmod(int(flat), server_count)
+        if priority[m, j] <= 0:
+            break
+        if problem["memory_requirement"][m] <= remaining[j]:
+            opened[m, j] = True
+            remaining[j] -= problem["memory_requirement"][m]
+    for m in np.flatnonzero(~opened.any(axis=1)):
+        totals = problem["cost"][problem["request_model"] == m].sum(axis=0)
+        fitting = np.flatnonzero(problem["memory_requirement"][m] <= remaining)
+        #nothing fits: place it anyway on the cheapest server, AMPL would report the model infeasible
+        j = fitting[np.argmin(totals[fitting])] if len(fitting) else int(np.argmin(totals))
+        opened[m, j] = True
+        remaining[j] -= problem["memory_requirement"][m]
+    return opened
+
+# sends every request to the cheapest server its model is open on
+def assign(problem, opened):
+    allowed = opened[problem["request_model"]]
+    return np.argmin(np.where(allowed, problem["cost"], np.inf), axis=1)
+
+def objective(problem, assignment):
+    return float((problem["cost"][np.arange(len(assignment)), assignment] * problem["weight"]).sum())
+
+# weighted number of requests of each model whose cheapest server is j
+def greedy_priority(problem):
+    preferred = np.argmin(problem["cost"], axis=1)
+    priority = np.zeros((len(problem["models"]), problem["cost"].shape[1]))
+    np.add.at(priority, (problem["request_model"], preferred), problem["weight"])
+    return priority
+
+# LP relaxation with fractional dispatch x[i,j] and placement y[m,j], returns (lower bound, y) or None
+def solve_relaxation(problem):
+    if linprog is None or len(problem["request_model"]) > lp_max_requests:
+        return None
+    cost = problem["cost"]
+    request_count, server_count = cost.shape
+    model_count = len(problem["models"])
+    x_count = request_count * server_count
+    rows = np.arange(x_count)
+    x_columns = np.arange(x_count)
+    y_columns = x_count + problem["request_model"].repeat(server_count) * server_count + np.tile(np.arange(server_count), request_count)
+    memory_rows = x_count + np.tile(np.arange(server_count), model_count)
+    memory_columns = x_count + np.arange(model_count * server_count)
+
+    #x[i,j] <= y[m(i),j] and sum_m requirement[m] * y[m,j] <= capacity[j]
+    upper = coo_matrix((np.concatenate([np.ones(x_count), -np.ones(x_count), problem["memory_requirement"].repeat(server_count)]),
+    (np.concatenate([rows, rows, memory_rows]), np.concatenate([x_columns, y_columns, memory_columns]))),
+    shape=(x_count + server_count, x_count + model_count * server_count))
+    upper_bound = np.concatenate([np.zeros(x_count), problem["capacity"]])
+    #sum_j x[i,j] = 1
+    equal = coo_matrix((np.ones(x_count), (np.arange(request_count).repeat(server_count), x_columns)),
+    shape=(request_count, x_count + model_count * server_count))
+
+    result = linprog(np.concatenate([(cost * problem["weight"][:, None]).ravel(), np.zeros(model_count * server_count)]), A_ub=upper.tocsr(), b_ub=upper_bound,
+    A_eq=equal.tocsr(), b_eq=np.ones(request_count), bounds=(0, 1), method='highs')
+    if result.status != 0:
+        return None
+    return result.fun, result.x[x_count:].reshape(model_count, server_count)
+
+# returns the request x server 0/1 matrix, details of the run are kept in solver_stats
+# warm_start ({model : [server ip]}, e.g. the previous placement) is the first incumbent,
+# so the greedy and LP placements replace it only when they are strictly cheaper
+def solve(request_stats, available_memory, memory_requirements, processing_times, server_ips, warm_start=None):
+    start = time.perf_counter()
+    solver_stats.clear()
+    if len(request_stats) == 0:
+        #empty request log, e.g. a fresh cluster, nothing to place
+        solver_stats.update({"method" : None, "objective" : 0.0, "lower_bound" : None, "requests" : 0, "solve_ms" : (time.perf_counter() - start) * 1000})
+        return []
+    problem = build_problem(request_stats, available_memory, memory_requirements, processing_times, server_ips)
+    preferred = greedy_priority(problem)
+    candidates = []
+    if warm_start:
+        previous = np.zeros(preferred.shape)
+        for m, model in enumerate(problem["models"]):
+            for ip in warm_start.get(model, []):
+                if ip in server_ips:
+                    previous[m, server_ips.index(ip)] = 1
+        candidates.append(('warm_start', previous + 1e-6 * preferred))
+    candidates.append(('greedy', preferred))
+
+    relaxation = solve_relaxation(problem)
+    lower_bound = None
+    if relaxation is not None:
+        lower_bound, placement = relaxation
+        #break ties between equally open placements by how many requests prefer them
+        candidates.append(('lp_rounding', placement + 1e-6 * preferred))
+
+    method = None
+    for name, priority in candidates:
+        candidate = assign(problem, open_servers(problem, priority))
+        if method is None or objective(problem, candidate) < best:
+            assignment = candidate
+            method = name
+            best = objective(problem, candidate)
+
+    results = np.zeros(problem["cost"].shape, dtype=int)
+    results[np.arange(len(assignment)), assignment] = 1
+    solver_stats.update({"method" : method, "objective" : best, "lower_bound" : lower_bound,
+    "requests" : len(assignment), "solve_ms" : (time.perf_counter() - start) * 1000})
+    return results.tolist()
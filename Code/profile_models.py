@@ -0,0 +1,170 @@
+import argparse
+import json
+import threading
+import time
+
+import requests
+
+import background_service_functions
+import cluster_inventory
+import model_profiles
+import node_metrics
+import reconciler
+
+# profiles every model on every node: deploys it pinned to the node (or uses a running
+# stand-in endpoint), sends a fixed number of sequential requests after a warmup, and
+# records p50/p95 processing time and the peak memory of the model's pod
+# the results are written as the next model_profiles version, which provisioning and
+# dispatch load when they start
+
+parser = argparse.ArgumentParser()
+parser.add_argument("-models", help="Comma separated models to profile. Defaults to every model in memory_requirements_table")
+parser.add_argument("-inventory", help="JSON inventory file of the nodes, instead of discovering them from the API server")
+parser.add_argument("-nodes", help="Comma separated node names to profile. Defaults to every node in the inventory")
+parser.add_argument("-requests", help="Timed requests per model and node. Defaults to 50", type=int, default=50)
+parser.add_argument("-warmup", help="Untimed requests sent first. Defaults to 5", type=int, default=5)
+parser.add_argument("-request_file", help="JSON file of the request to send per model, {model : {\"method\", \"path\", \"body\"}}. Defaults to GET /")
+parser.add_argument("-endpoint", help="host:port of a running stand-in model server, profiled instead of deploying to the cluster")
+parser.add_argument("-address", help="Node address the stand-in results are recorded under. Defaults to 127.0.0.1", default='127.0.0.1')
+parser.add_argument("-pid", help="Process id of the stand-in server, its peak RSS (reset before each model) is recorded as the model memory", type=int)
+parser.add_argument("-ready_timeout", help="Seconds to wait for a profiling deployment to become ready. Defaults to 300", type=float, default=300)
+parser.add_argument("-keep", help="Keep the profiling deployments instead of deleting them", action='store_true')
+args = parser.parse_args()
+
+#seconds between pod memory samples during a run
+memory_sample_interval = 0.5
+
+def percentile(values, quantile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+def load_request_specs():
+    if args.request_file is None:
+        return {}
+    with open(args.request_file) as f:
+        return json.load(f)
+
+# seconds per request for count requests, after warmup untimed ones
+def run_load(session, endpoint, spec, count, warmup):
+    url = 'http://' + endpoint + spec.get('path', '/')
+    body = spec.get('body')
+    times = []
+    for index in range(warmup + count):
+        start = time.perf_counter()
+        response = session.request(spec.get('method', 'GET'), url, json=body)
+        response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        if index >= warmup:
+            times.append(elapsed)
+    return times
+
+# peak memory (bytes) of the model's pods while the load runs, sampled from metrics.k8s.io
+class PodMemorySampler:
+    def __init__(self, pod_prefix):
+        self.pod_prefix = pod_prefix
+        self.peak = 0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.sample_loop, daemon=True)
+
+    def sample_loop(self):
+        while not self.stop_event.is_set():
+            try:
+                pods = background_service_functions.custom_obj_api.list_namespaced_custom_object("metrics.k8s.io", "v1beta1", background_service_functions.namespace, "pods")
+                for pod in pods['items']:
+                    if pod['metadata']['name'].startswith(self.pod_prefix):
+                        self.peak = max(self.peak, sum(node_metrics.parse_memory(container['usage']['memory']) for container in pod['containers']))
+            except Exception as e:
+                print('POD METRICS UNAVAILABLE')
+                print(e)
+            self.stop_event.wait(memory_sample_interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop_event.set()
+        self.thread.join()
+
+# resets the peak RSS of a local process, so the next reading only covers what runs after it
+# returns False when the kernel or permissions do not allow it
+def reset_peak_rss(pid):
+    try:
+        with open('/proc/' + str(pid) + '/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError as e:
+        print('CANT RESET PEAK RSS OF ' + str(pid))
+        print(e)
+        return False
+
+# peak RSS (bytes) of a local process from /proc
+def process_peak_rss(pid):
+    with open('/proc/' + str(pid) + '/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def wait_until_ready(model, node_name):
+    deadline = time.monotonic() + args.ready_timeout
+    while not background_service_functions.check_model_available(model, node_name):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(1)
+    return True
+
+# deploys model to node, measures it and removes it again, returns (times, peak bytes) or None
+def profile_on_cluster(session, model, node_name, node_address, spec):
+    target = model + '-' + node_name
+    created = not background_service_functions.check_model_available(model, node_name)
+    if created and not background_service_functions.provision_model(model, node_name):
+        print('CANT DEPLOY ' + target)
+        return None
+    try:
+        if not wait_until_ready(model, node_name):
+            print('DEPLOYMENT NOT READY: ' + target)
+            return None
+        node_port = background_service_functions.v1.read_namespaced_service(target, background_service_functions.namespace).spec.ports[0].node_port
+        with PodMemorySampler(reconciler.pod_prefix(model, node_name)) as sampler:
+            times = run_load(session, node_address + ':' + str(node_port), spec, args.requests, args.warmup)
+        return times, sampler.peak
+    finally:
+        if created and not args.keep:
+            background_service_functions.delete_deployment(target)
+
+def record(profile, model, address, times, peak_bytes):
+    profile["processing_time"].setdefault(model, {})[address] = round(percentile(times, 0.5), 4)
+    profile["processing_time_p95"].setdefault(model, {})[address] = round(percentile(times, 0.95), 4)
+    if peak_bytes:
+        #a model's requirement is the most it needed on any node
+        profile["memory"][model] = max(profile["memory"].get(model, 0), int(peak_bytes / (1024 * 1024)) + 1)
+    print(model + ' on ' + address + ': p50 ' + str(profile["processing_time"][model][address]) + ' s, p95 ' +
+    str(profile["processing_time_p95"][model][address]) + ' s, peak ' + str(int(peak_bytes / (1024 * 1024))) + ' MiB')
+
+if __name__ == "__main__":
+    models = args.models.split(',') if args.models else list(background_service_functions.memory_requirements_table)
+    specs = load_request_specs()
+    session = requests.Session()
+    profile = {"processing_time" : {}, "processing_time_p95" : {}, "memory" : {}, "requests" : args.requests}
+
+    if args.endpoint:
+        for position, model in enumerate(models):
+            #every model runs against the same process, so its peak is reset before each one
+            #and without a reset only the first model's peak is its own
+            measure_memory = args.pid is not None and (reset_peak_rss(args.pid) or position == 0)
+            times = run_load(session, args.endpoint, specs.get(model, {}), args.requests, args.warmup)
+            record(profile, model, args.address, times, process_peak_rss(args.pid) if measure_memory else 0)
+    else:
+        cluster_inventory.refresh(background_service_functions.v1, args.inventory)
+        wanted = set(args.nodes.split(',')) if args.nodes else None
+        for column in range(cluster_inventory.get_server_count()):
+            node_name = cluster_inventory.get_server_name(column)
+            if wanted is not None and node_name not in wanted:
+                continue
+            for model in models:
+                result = profile_on_cluster(session, model, node_name, cluster_inventory.get_server_ips()[column], specs.get(model, {}))
+                if result is not None:
+                    record(profile, model, cluster_inventory.get_server_ips()[column], *result)
+
+    print('\nWROTE MODEL PROFILE v' + str(model_profiles.save_profile(profile)))
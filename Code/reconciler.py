@@ -0,0 +1,36 @@
+# desired-state provisioning: the solver matrix becomes a set of (model, node_name)
+# placements, which is diffed in memory against one snapshot of the deployments in the
+# namespace, so provisioning makes one list call plus one call per change
+
+# placements with a 1 anywhere in their model's rows, server_names[j] is the node of column j
+def desired_placements(solver_results, request_stats, server_names):
+    desired = set()
+    for i in range(0, len(solver_results)):
+        model = request_stats[str(i)]['model']
+        for j, value in enumerate(solver_results[i]):
+            if value == 1:
+                desired.add((model, server_names[j]))
+    return desired
+
+# name prefix of the pods of the deployment provision_model creates for model on node_name
+def pod_prefix(model, node_name):
+    return model + '-' + node_name + '-deployment-'
+
+# placements of the deployments provision_model created, "<model>-<node>-deployment" pinned with nodeName
+def current_placements(deployments):
+    current = set()
+    for currentDeployment in deployments:
+        name = currentDeployment.metadata.name
+        if not name.endswith('-deployment'):
+            continue
+        node_name = currentDeployment.spec.template.spec.node_name
+        if node_name is None:
+            continue
+        current.add((name.split('-')[0], node_name))
+    return current
+
+# (creates, deletes), deletes only cover models in managed_models so models the solver did not see are left alone
+def plan(desired, current, managed_models):
+    creates = sorted(desired - current)
+    deletes = sorted(placement for placement in current - desired if placement[0] in managed_models)
+    return creates, deletes
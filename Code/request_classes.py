@@ -0,0 +1,32 @@
+# groups request stats into weighted classes of (model, origin server, latency bucket)
+# so the solver sees one row per distinct kind of request instead of one per request
+# a class carries the mean latency of its members, so weight * (latency + exec time) is
+# the same total cost its members had, and provisioning reads the models off the class rows
+
+#width of a latency bucket, in the units clients report latency in
+latency_bucket_width = 1.0
+
+def class_key(request):
+    return (request['model'], request['server'], int(float(request['latency']) // latency_bucket_width))
+
+# classes in the request_stats format ({index : entry}) plus a weight field, from any iterable
+# of request entries, e.g. the streamed request log, keeping only a count and latency sum per class
+# entries that are classes already count with their weight
+def aggregate(requests):
+    index_of = {}
+    weights = []
+    latency_sums = []
+    for request in requests:
+        key = class_key(request)
+        if key not in index_of:
+            index_of[key] = len(weights)
+            weights.append(0)
+            latency_sums.append(0.0)
+        weight = request.get('weight', 1)
+        weights[index_of[key]] += weight
+        latency_sums[index_of[key]] += weight * float(request['latency'])
+
+    classes = {}
+    for (model, server, bucket), c in index_of.items():
+        classes[str(c)] = {"model" : model, "server" : server, "latency" : latency_sums[c] / weights[c], "weight" : weights[c]}
+    return classes
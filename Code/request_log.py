@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+
+# append-only request log replacing request_stats.json
+# every dispatched request is one JSON line appended to the active segment,
+# segments are rotated by size and old ones are periodically merged and trimmed
+
+log_directory = 'request_log'
+#bytes before the active segment is sealed and a new one started
+max_segment_bytes = 4 * 1024 * 1024
+#newest entries kept by compaction, older ones are dropped
+max_entries = 100000
+#seconds between compaction runs
+compaction_interval = 300
+#legacy file imported the first time the log is opened
+legacy_stats_file = 'request_stats.json'
+
+log_lock = threading.Lock()
+active_file = None
+active_segment = None
+entry_count = 0
+started = False
+
+def segment_path(number):
+    return os.path.join(log_directory, 'segment-%06d.jsonl' % number)
+
+def list_segments():
+    segments = []
+    for name in os.listdir(log_directory):
+        if name.startswith('segment-') and name.endswith('.jsonl'):
+            segments.append(int(name[len('segment-') : -len('.jsonl')]))
+    return sorted(segments)
+
+def count_lines(path_name):
+    with open(path_name, 'rb') as file:
+        return sum(1 for _ in file)
+
+def open_segment(number):
+    global active_file, active_segment
+    if active_file is not None:
+        active_file.close()
+    active_segment = number
+    active_file = open(segment_path(number), 'a')
+
+# copies the entries of the old rewrite-the-world request_stats.json into the log once
+def import_legacy_stats():
+    if not os.path.exists(legacy_stats_file):
+        return
+    try:
+        with open(legacy_stats_file) as file:
+            legacy_stats = json.load(file)
+    except Exception as e:
+        print('CANT OPEN FILE REQUEST STATS')
+        return
+    for key in sorted(legacy_stats, key=int):
+        write_entry(legacy_stats[key])
+
+# opens the newest segment for appending and starts the compaction thread, safe to call more than once
+def start_request_log():
+    global entry_count, started
+    with log_lock:
+        if started:
+            return
+        started = True
+        os.makedirs(log_directory, exist_ok=True)
+        segments = list_segments()
+        entry_count = sum(count_lines(segment_path(number)) for number in segments)
+        open_segment(segments[-1] if segments else 1)
+        if not segments:
+            import_legacy_stats()
+    threading.Thread(target=compaction_loop, name='request-log-compaction', daemon=True).start()
+
+def write_entry(entry):
+    global entry_count
+    active_file.write(json.dumps(entry) + '\n')
+    active_file.flush()
+    entry_count += 1
+    if active_file.tell() >= max_segment_bytes:
+        open_segment(active_segment + 1)
+
+# appends one dispatched request, O(1) regardless of history length
+def append_request(model_requested, latency_value, server_recommended, server_name):
+    with log_lock:
+        write_entry({"model" : model_requested, "latency" : latency_value, "server" : server_recommended, "server_name" : server_name})
+        return entry_count - 1
+
+def get_entry_count():
+    with log_lock:
+        return entry_count
+
+# yields every logged request oldest first without loading the history into memory
+def stream_requests():
+    with log_lock:
+        active_file.flush()
+        #open every segment up front so compaction can not remove one from under the reader
+        files = []
+        for number in list_segments():
+            file = open(segment_path(number))
+            size = os.path.getsize(segment_path(number))
+            files.append((file, size))
+    for file, size in files:
+        with file:
+            #lines appended after the stream started are left for the next reader
+            while file.tell() < size:
+                line = file.readline()
+                if not line.endswith('\n'):
+                    break
+                yield json.loads(line)
+
+# merges all sealed segments into one and drops the oldest entries beyond max_entries
+def compact():
+    global entry_count
+    with log_lock:
+        sealed = [number for number in list_segments() if number != active_segment]
+        drop = max(0, entry_count - max_entries)
+    if not sealed or (len(sealed) == 1 and drop == 0):
+        return 0
+    target = segment_path(sealed[-1])
+    temp_path = target + '.compacting'
+    dropped = 0
+    with open(temp_path, 'w') as output:
+        for number in sealed:
+            with open(segment_path(number)) as segment:
+                for line in segment:
+                    if dropped < drop:
+                        dropped += 1
+                        continue
+                    output.write(line)
+        output.flush()
+        os.fsync(output.fileno())
+    with log_lock:
+        os.replace(temp_path, target)
+        for number in sealed[:-1]:
+            os.remove(segment_path(number))
+        entry_count -= dropped
+    return dropped
+
+def compaction_loop():
+    while True:
+        time.sleep(compaction_interval)
+        try:
+            dropped = compact()
+            if dropped:
+                print('REQUEST LOG COMPACTED, DROPPED ' + str(dropped) + ' ENTRIES')
+        except Exception as e:
+            print('REQUEST LOG COMPACTION FAILED')
+            print(e)
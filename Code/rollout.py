@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+import time
+
+import phase_metrics
+import reconciler
+
+# parallel rollout for perform_provisioning
+# every required deployment is created at once, then a single pod watch reports when
+# each one has a ready pod on its node, so a cycle waits about as long as the slowest
+# deployment instead of the sum of all of them, without polling the pod list
+# a deployment that is not ready within ready_timeout of the rollout start is reported as timed out
+
+#seconds each deployment may take to become ready
+ready_timeout = 300
+#deployments created at the same time
+create_concurrency = 8
+#seconds one watch request stays open before it is renewed
+watch_window = 30
+
+#{model-node : {"ready", "seconds", "error"}} of the last rollout
+last_report = {}
+
+# same test as check_model_available, the pod must belong to the model's deployment on node_name
+def placement_ready(pod, model, node_name):
+    if not pod.metadata.name.startswith(reconciler.pod_prefix(model, node_name)) or pod.spec.node_name != node_name:
+        return False
+    return pod.status.container_statuses is not None and pod.status.container_statuses[0].ready
+
+# (model, node_name) pairs among placements with a ready pod in pods
+def ready_placements(pods, placements):
+    return {placement for placement in placements if any(placement_ready(pod, placement[0], placement[1]) for pod in pods)}
+
+def create_all(targets, create):
+    failed = {}
+    with ThreadPoolExecutor(max_workers=create_concurrency) as executor:
+        futures = {target : executor.submit(create, target[0], target[1]) for target in targets}
+        for target, future in futures.items():
+            try:
+                if not future.result():
+                    failed[target] = 'create failed'
+            except Exception as e:
+                print(e)
+                failed[target] = str(e)
+    return failed
+
+# creates every (model, node_name) target with create(model, node_name) and waits for them to be ready
+# returns True when all of them became ready, per-deployment results are kept in last_report
+def roll_out(targets, v1, namespace, create):
+    start = time.monotonic()
+    report = {}
+    listing = v1.list_namespaced_pod(namespace, watch=False)
+    resource_version = listing.metadata.resource_version
+
+    failed = create_all(targets, create)
+    pending = [target for target in targets if target not in failed]
+    for target, error in failed.items():
+        report[target] = {"ready" : False, "seconds" : None, "error" : error}
+
+    def mark_ready(pods):
+        for target in ready_placements(pods, pending):
+            elapsed = time.monotonic() - start
+            pending.remove(target)
+            report[target] = {"ready" : True, "seconds" : round(elapsed, 2), "error" : None}
+            phase_metrics.record('deployment_ready', elapsed * 1000)
+            print('READY: ' + target[0] + ' ON SERVER ' + target[1] + ' AFTER ' + str(round(elapsed, 2)) + ' S')
+
+    mark_ready(listing.items)
+    while pending:
+        remaining = start + ready_timeout - time.monotonic()
+        if remaining <= 0:
+            break
+        pod_watch = watch.Watch()
+        try:
+            for event in pod_watch.stream(v1.list_namespaced_pod, namespace, resource_version=resource_version, timeout_seconds=max(1, int(min(remaining, watch_window)))):
+                if event['type'] == 'ERROR':
+                    raise ApiException(status=410)
+                if event['type'] == 'BOOKMARK':
+                    continue
+                resource_version = event['object'].metadata.resource_version
+                if event['type'] != 'DELETED':
+                    mark_ready([event['object']])
+                if not pending or time.monotonic() > start + ready_timeout:
+                    pod_watch.stop()
+        except ApiException as e:
+            if e.status != 410:
+                print('ROLLOUT WATCH FAILED')
+                print(e)
+                time.sleep(1)
+            #resume from a fresh list, the resource version is too old or the watch broke
+            listing = v1.list_namespaced_pod(namespace, watch=False)
+            resource_version = listing.metadata.resource_version
+            mark_ready(listing.items)
+
+    for target in pending:
+        report[target] = {"ready" : False, "seconds" : None, "error" : 'not ready after ' + str(ready_timeout) + ' s'}
+        print('TIMED OUT: ' + target[0] + ' ON SERVER ' + target[1])
+    last_report.clear()
+    last_report.update({model + '-' + node_name : result for (model, node_name), result in report.items()})
+    print('ROLLOUT OF ' + str(len(targets)) + ' DEPLOYMENTS TOOK ' + str(round(time.monotonic() - start, 2)) + ' S')
+    return all(result["ready"] for result in report.values())
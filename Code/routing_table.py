@@ -0,0 +1,154 @@
+import threading
+
+import cluster_cache
+import load_balancing
+import node_metrics
+import node_scoring
+import telemetry
+
+# materialized model -> "host:nodePort" routing table for GET /services
+# built in one pass over the cached pods and services and one metrics snapshot,
+# then kept current: cache events only rebuild the models they touch and
+# a new metrics snapshot rebuilds the whole table
+# the placement, model -> every "host:nodePort" serving it, is versioned separately: only a
+# change of the placement bumps the version, so clients can cache it and long-poll for
+# changes, while the best host in the table may move with every metrics snapshot
+
+#seconds between background refreshes while the route refresher runs
+refresh_interval = 1.0
+
+build_lock = threading.Lock()
+state_lock = threading.Lock()
+version_condition = threading.Condition()
+change_event = threading.Event()
+routes = {}
+version = 0
+dirty_models = set()
+full_rebuild = True
+built_snapshot_time = None
+placements = {}
+#placement as of the current version, compared against every rebuild to detect changes
+published_placements = {}
+started = False
+
+def start_routing_table():
+    global started
+    with state_lock:
+        if started:
+            return
+        started = True
+    cluster_cache.add_listener(on_cluster_change)
+
+# pod and service names start with the model name, e.g. resnet-jetsonnanoone-deployment-...
+def model_of(name):
+    return name.split('-')[0]
+
+def on_cluster_change(kind, name):
+    global full_rebuild
+    with state_lock:
+        if name is None or kind == "nodes":
+            full_rebuild = True
+        elif kind in ("pods", "services"):
+            dirty_models.add(model_of(name))
+        else:
+            return
+    change_event.set()
+
+# (best replica host, sorted endpoints) of every model in models (None for all) that has a service
+def build_entries(models, custom_obj_api, dispatch_policy):
+    usage = node_metrics.get_snapshot(custom_obj_api)
+    ports = {}
+    for currentService in cluster_cache.get_services():
+        model = model_of(currentService.metadata.name)
+        if (models is None or model in models) and model not in ports:
+            ports[model] = currentService.spec.ports[0].node_port
+
+    best = {}
+    hosts = {}
+    endpoints = {}
+    for currentPod in cluster_cache.get_pods():
+        model = model_of(currentPod.metadata.name)
+        node_name = currentPod.spec.node_name
+        host_ip = currentPod.status.host_ip
+        if model not in ports or host_ip is None:
+            continue
+        if ports[model] is not None:
+            endpoints.setdefault(model, set()).add(host_ip + ':' + str(ports[model]))
+        if node_name not in usage:
+            continue
+        hosts.setdefault(model, []).append(host_ip)
+        cpu = telemetry.get_smoothed_cpu(node_name, usage[node_name]['cpu'])
+        if model not in best or cpu < best[model]['cpu']:
+            best[model] = {'host' : host_ip, 'name' : node_name, 'cpu' : cpu}
+
+    entries = {}
+    for model in best:
+        #the selected dispatch policy picks the host, as it does for a single service
+        if dispatch_policy == 'score':
+            node_scoring.select_node(model, hosts[model], best[model], custom_obj_api)
+        elif dispatch_policy == 'p2c':
+            load_balancing.select_node(model, hosts[model], best[model], custom_obj_api)
+        if ports[model] is None:
+            entries[model] = 'Deployment in progress'
+        else:
+            entries[model] = best[model]['host'] + ':' + str(ports[model])
+    return entries, {model : sorted(model_endpoints) for model, model_endpoints in endpoints.items()}
+
+# returns the current routing table, rebuilding only what changed since the last call
+def get_routing_table(custom_obj_api, dispatch_policy):
+    global routes, placements, full_rebuild, built_snapshot_time, version, published_placements
+    node_metrics.get_snapshot(custom_obj_api)
+    with build_lock:
+        snapshot_time = node_metrics.get_snapshot_time()
+        with state_lock:
+            rebuild_all = full_rebuild or snapshot_time != built_snapshot_time
+            changed = set(dirty_models)
+            full_rebuild = False
+            dirty_models.clear()
+        if rebuild_all:
+            routes, placements = build_entries(None, custom_obj_api, dispatch_policy)
+            built_snapshot_time = snapshot_time
+        elif changed:
+            updated = dict(routes)
+            updated_placements = dict(placements)
+            for model in changed:
+                updated.pop(model, None)
+                updated_placements.pop(model, None)
+            entries, endpoints = build_entries(changed, custom_obj_api, dispatch_policy)
+            updated.update(entries)
+            updated_placements.update(endpoints)
+            routes = updated
+            placements = updated_placements
+        current = dict(routes)
+        current_placements = dict(placements)
+    with version_condition:
+        if current_placements != published_placements:
+            published_placements = current_placements
+            version += 1
+            version_condition.notify_all()
+    return current
+
+# returns (version, placement) for the current table, the placement maps each model to its endpoints
+def get_versioned_routes(custom_obj_api, dispatch_policy):
+    get_routing_table(custom_obj_api, dispatch_policy)
+    with version_condition:
+        return version, published_placements
+
+# blocks until the placement version is newer than after_version or timeout seconds pass, returns (version, placement)
+def wait_for_change(after_version, timeout):
+    with version_condition:
+        version_condition.wait_for(lambda: version > after_version, timeout)
+        return version, published_placements
+
+# keeps the table and its version current without waiting for a reader, so long-polls see changes
+def start_route_refresher(custom_obj_api, dispatch_policy):
+    def refresh_loop():
+        while True:
+            change_event.wait(refresh_interval)
+            change_event.clear()
+            try:
+                get_routing_table(custom_obj_api, dispatch_policy)
+            except Exception as e:
+                print('ROUTING TABLE REFRESH FAILED')
+                print(e)
+    threading.Thread(target=refresh_loop, name='route-refresher', daemon=True).start()
@@ -1,8 +1,20 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, make_response, request, jsonify, stream_with_context
 import json
 import importlib
 import argparse
-import time
+
+import admission_control
+import cluster_cache
+import deployment_worker
+import dispatch_counters
+import model_stats_store
+import node_metrics
+import node_scoring
+import phase_metrics
+import request_log
+import routing_table
+import telemetry
+import upstream_proxy
 
 frontend_service_functions = None
 background_service_functions = None
@@ -10,6 +22,10 @@ background_service_functions = None
 parser = argparse.ArgumentParser()
 parser.add_argument("-mode", help="Specify 1 or 2 to choose server operating mode. Defaults to 1", type=int)
 parser.add_argument("-m", help="Specify 1 or 2 to choose server operating mode. Defaults to 1", type=int)
+parser.add_argument("-asgi", help="Serve with the asyncio (ASGI) server instead of the Flask development server", action='store_true')
+parser.add_argument("-dispatch", help="Replica selection policy: cpu (lowest cpu usage), score (multi-criteria scoring) or p2c (power of two choices). Defaults to cpu", choices=['cpu', 'score', 'p2c'], default='cpu')
+parser.add_argument("-admission", help="Reject or redirect dispatches that would miss their latency budget", action='store_true')
+parser.add_argument("-metrics_ttl", help="Seconds a node metrics snapshot is reused for dispatch. Defaults to 2", type=float)
 args = parser.parse_args()
 
 if args.mode == 2 or args.m == 2:
@@ -21,76 +37,124 @@ else:
     background_service_functions = importlib.import_module('background_service_functions', __name__)
     print('\nStarting With Serving Mode: 1\n')
 
+frontend_service_functions.dispatch_policy = args.dispatch
+print('Dispatch Policy: ' + args.dispatch + '\n')
+frontend_service_functions.admission_control_enabled = args.admission
+
+if args.metrics_ttl is not None:
+    node_metrics.set_snapshot_ttl(args.metrics_ttl)
+
+model_stats_store.start_model_stats_store()
+routing_table.start_route_refresher(frontend_service_functions.custom_obj_api, args.dispatch)
+request_log.start_request_log()
+
 app = Flask(__name__)
 
 @app.route('/')
 def index():
     return 'Thesis 2021 - Kubernetes Edge Manager \nAnish Prasad'
 
+# passes the cold-start retry hint of a dispatch result on as a Retry-After header
+def with_retry_after(result):
+    response = make_response(result)
+    retry_after = json.loads(result).get('retry_after')
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @app.route('/services', methods = ['GET'])
 def get_all_service_node():
-    model_stats = {}
-
-    try:
-        file = open('model_stats.json')
-        model_stats = json.load(file)
-        file.close()
-    except:
-        print('Unable to Open File')
-
     request_body = request.json
 
     if request_body is not None:
         if 'latency' in request_body:
-            result = frontend_service_functions.get_best_node_specific_service(request.json, False, model_stats)
-            time2 = time.perf_counter()
-            with open('model_stats.json', 'w') as save_file:
-                json.dump(model_stats, save_file)
-            save_file.close()
-            return result
+            return with_retry_after(frontend_service_functions.get_best_node_specific_service(request.json))
         else:
-            return frontend_service_functions.get_best_nodes(model_stats)
+            return frontend_service_functions.get_best_nodes()
+    else:
+        return frontend_service_functions.get_best_nodes()
+
+# versioned model -> [host:nodePort] placement for clients that cache routes, the version
+# only changes when a replica is added or removed, picking among them is left to dispatch
+# If-None-Match with the current ETag answers 304, ?after=<version> long-polls
+# until the placement changes past that version or ?timeout= seconds (default 30) pass
+@app.route('/routes', methods = ['GET'])
+def get_routes():
+    after = request.args.get('after', type=int)
+    if after is not None:
+        version, routes = routing_table.wait_for_change(after, min(request.args.get('timeout', 30, type=float), 300))
+    else:
+        version, routes = routing_table.get_versioned_routes(frontend_service_functions.custom_obj_api, args.dispatch)
+
+    etag = '"' + str(version) + '"'
+    if request.headers.get('If-None-Match') == etag:
+        response = make_response('', 304)
     else:
-        return frontend_service_functions.get_best_nodes(model_stats)
+        response = jsonify({"version" : version, "routes" : routes})
+    response.headers['ETag'] = etag
+    return response
 
 @app.route('/services/<model>/<api_type>/<model_folder>/<model_name_request_type>', methods = ['POST'])
 def proxy_request(model, api_type, model_folder, model_name_request_type):
-    model_stats = {}
-    try:
-        file = open('model_stats.json')
-        model_stats = json.load(file)
-        file.close()
-    except:
-        print('Unable to Open File')
-
-    request_body = request.json
+    # a latency sent as a header or query argument lets the body stream straight through,
+    # otherwise it is read from the JSON body and the buffered body is forwarded
+    latency = request.headers.get('X-Latency', request.args.get('latency'))
+    if latency is not None:
+        body = request.stream
+    else:
+        body = request.get_data()
+        latency = json.loads(body)['latency']
 
-    result = frontend_service_functions.get_best_node_specific_service({"model" : model, "latency" : request_body['latency']}, False, model_stats)
-    with open('model_stats.json', 'w') as save_file:
-        json.dump(model_stats, save_file)
-    save_file.close()
+    result = frontend_service_functions.get_best_node_specific_service({"model" : model, "latency" : float(latency)})
 
     print(result)
 
     endpoint = json.loads(result)
 
     if endpoint[model] == 'Does not exist, creating new deployment':
-        return json.dumps({model : 'Model does not exist, creating new deployment. Try again later'})
-    else:
+        response = with_retry_after(json.dumps({model : 'Model does not exist, creating new deployment. Try again later', "retry_after" : endpoint['retry_after']}))
+        response.status_code = 503
+        return response
+    elif endpoint[model] == 'Deployment in progress':
+        return json.dumps({model : 'Deployment in progress. Try again later'}), 503
+    elif endpoint[model] == 'Unknown Service':
         return "Model not found", 404
+    elif endpoint[model] == 'Overloaded':
+        return with_retry_after(json.dumps({model : 'Overloaded. Try again later', "retry_after" : endpoint['retry_after']})), 503
+
+    host = endpoint[model].split(':')[0]
+    node_name = cluster_cache.get_node_name(host)
+    path = '/' + api_type + '/' + model_folder + '/' + model_name_request_type
+    if request.query_string:
+        path += '?' + request.query_string.decode()
+
+    admitted = False
+    if frontend_service_functions.admission_control_enabled:
+        admitted = admission_control.acquire(model, node_name, host, latency)
+        if not admitted:
+            return with_retry_after(json.dumps({model : 'Overloaded. Try again later', "retry_after" : 1})), 503
+
+    def finish_request():
+        dispatch_counters.end_request(model, node_name)
+        if admitted:
+            admission_control.release(model, node_name)
+
+    dispatch_counters.begin_request(model, node_name)
+    try:
+        upstream = upstream_proxy.open_upstream(request.method, endpoint[model], path, request.headers, body, request.content_length)
+    except Exception as e:
+        finish_request()
+        print('PROXY REQUEST FAILED: ' + endpoint[model])
+        print(e)
+        return json.dumps({model : 'Model endpoint unreachable'}), 502
+
+    return Response(stream_with_context(upstream_proxy.stream_body(upstream, finish_request)),
+        status=upstream.status, headers=upstream_proxy.response_headers(upstream))
 
 @app.route('/dev/model_stats', methods = ['GET', 'POST'])
 def get_model_stats():
-    model_stats = {}
-    try:
-        file = open('model_stats.json')
-        model_stats = json.load(file)
-        file.close()
-    except:
-        print('Unable to Open File')
-
     if request.method == 'GET':
-        return jsonify(model_stats)
+        return jsonify(model_stats_store.get_model_stats())
     elif request.method == 'POST':
         request_body = request.json
 
@@ -108,14 +172,28 @@ def get_model_stats():
 
 @app.route('/dev/request_stats', methods = ['GET'])
 def get_request_stats():
-    request_stats = {}
-    try:
-        file = open('request_stats.json')
-        request_stats = json.load(file)
-        file.close()
-        return jsonify(request_stats)
-    except:
-        print('CANT OPEN FILE GETTING STATS')
+    # ?format=jsonl streams one request per line, otherwise the old {"0" : {...}, ...} object is streamed
+    if request.args.get('format') == 'jsonl':
+        return Response(stream_request_lines(), mimetype='application/x-ndjson')
+    return Response(stream_request_object(), mimetype='application/json')
+
+def stream_request_lines():
+    for entry in request_log.stream_requests():
+        yield json.dumps(entry) + '\n'
+
+def stream_request_object():
+    yield '{'
+    for index, entry in enumerate(request_log.stream_requests()):
+        yield (', ' if index > 0 else '') + json.dumps(str(index)) + ': ' + json.dumps(entry)
+    yield '}'
+
+@app.route('/dev/telemetry', methods = ['GET'])
+def get_telemetry():
+    if request.method == 'GET':
+        limit = request.args.get('limit', type=int)
+        return jsonify(telemetry.get_telemetry(limit))
+    else:
+        return 'Method Not Allowed', 405
 
 @app.route('/dev/server_mem_stats', methods = ['GET'])
 def get_server_mem_stats():
@@ -124,6 +202,41 @@ def get_server_mem_stats():
     else:
         return 'Method Not Allowed', 405
 
+@app.route('/dev/cache_stats', methods = ['GET'])
+def get_cache_stats():
+    cache_stats = cluster_cache.get_cache_stats()
+    cache_stats['node_metrics'] = node_metrics.get_snapshot_stats()
+    return jsonify(cache_stats)
+
+@app.route('/dev/deployment_stats', methods = ['GET'])
+def get_deployment_stats():
+    return jsonify(deployment_worker.get_deployment_stats())
+
+@app.route('/dev/admission_stats', methods = ['GET'])
+def get_admission_stats():
+    return jsonify(admission_control.get_admission_stats())
+
+@app.route('/dev/proxy_stats', methods = ['GET'])
+def get_proxy_stats():
+    return jsonify({"upstreams" : upstream_proxy.get_pool_stats(), "load" : dispatch_counters.get_all_counters()})
+
+@app.route('/dev/metrics', methods = ['GET', 'POST'])
+def get_phase_metrics():
+    # the provisioning process posts its histograms here after every run
+    if request.method == 'POST':
+        phase_metrics.merge_histograms(request.json)
+        return '200 OK'
+    return jsonify(phase_metrics.get_summary())
+
+@app.route('/dev/score_weights', methods = ['GET', 'POST'])
+def score_weights():
+    if request.method == 'POST':
+        try:
+            node_scoring.set_score_weights(request.json)
+        except ValueError as e:
+            return str(e), 400
+    return jsonify(node_scoring.get_score_weights())
+
 @app.route('/dev/replicas/<target>/<number>')
 def dev_update_replicas(target, number):
     return background_service_functions.update_replicas(target, number)
@@ -132,4 +245,9 @@ def dev_update_replicas(target, number):
 def dev_delete_deployment(target):
     return background_service_functions.delete_deployment(target)
 
-app.run(host='0.0.0.0', port=24432)
\ No newline at end of file
+if args.asgi:
+    print('Serving With: ASGI\n')
+    import async_server
+    async_server.run(app, frontend_service_functions, host='0.0.0.0', port=24432)
+else:
+    app.run(host='0.0.0.0', port=24432)
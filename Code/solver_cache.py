@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import request_classes
+
+# on-disk cache of solver results keyed by the sha256 of the normalized solver inputs
+# solver rows, single requests or request classes, are grouped into request classes
+# (see request_classes) and results are kept per class, so every backend hits alike
+# classes are hashed in a canonical order so the same request mix hits however the
+# request log happened to order it, and node memory is rounded down to memory_quantum
+# so the smoothed free memory does not change the key on every run
+# demand is hashed as shares rather than request counts, since the request log only grows:
+# each class by its latency bucket and its share of its model's requests, each model by its
+# share of all requests, both rounded to share_quantum, so a request mix whose shares all
+# moved less than about share_quantum / 2 reuses the placement solved for the earlier mix
+# least recently used entries (by file mtime, touched on every hit) are evicted past max_entries
+
+cache_dir = 'solver_cache'
+#entries kept before the least recently used are evicted
+max_entries = 64
+#Ki, node memory is rounded down to a multiple of this before hashing
+memory_quantum = 65536
+#demand shares are rounded to a multiple of this before hashing, 0 hashes exact request counts
+share_quantum = 0.05
+stats_file = 'stats.json'
+
+# class keys of the rows' request classes in a canonical order, the key is built from the
+# classes rather than the rows, so backends solving one row per request hit as well
+def canonical_keys(rows):
+    return sorted({request_classes.class_key(rows[str(i)]) for i in range(len(rows))})
+
+def quantize(share):
+    return round(share / share_quantum) if share_quantum > 0 else share
+
+# [[model, server, latency bucket, share of the model's requests]] and {model : share of all requests}
+def normalized_demand(rows):
+    classes = request_classes.aggregate(rows[str(i)] for i in range(len(rows)))
+    weights = {request_classes.class_key(request_class) : request_class['weight'] for request_class in classes.values()}
+    model_weights = {}
+    for (model, server, bucket), weight in weights.items():
+        model_weights[model] = model_weights.get(model, 0) + weight
+    total_weight = sum(model_weights.values())
+    demand = [[model, server, bucket, quantize(weights[(model, server, bucket)] / model_weights[model])] for model, server, bucket in sorted(weights)]
+    return demand, {model : quantize(weight / total_weight) for model, weight in model_weights.items()}
+
+def cache_key(solver, rows, node_mem, memory_requirements, processing_times, server_ips):
+    demand, model_shares = normalized_demand(rows)
+    inputs = {"solver" : solver, "classes" : demand, "models" : model_shares,
+    "memory" : [int(node_mem.get(ip, 0)) // memory_quantum for ip in server_ips],
+    "memory_requirements" : memory_requirements, "processing_times" : processing_times, "servers" : list(server_ips)}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+def entry_path(key):
+    return os.path.join(cache_dir, key + '.json')
+
+def write_json(file_name, data):
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix='.solver_cache-', dir=cache_dir)
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            json.dump(data, temp_file)
+        os.replace(temp_path, os.path.join(cache_dir, file_name))
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def load_stats():
+    try:
+        with open(os.path.join(cache_dir, stats_file)) as file:
+            return json.load(file)
+    except Exception:
+        return {"hits" : 0, "misses" : 0}
+
+def count(result):
+    stats = load_stats()
+    stats[result] += 1
+    try:
+        write_json(stats_file, stats)
+    except Exception as e:
+        print('SOLVER CACHE STATS WRITE FAILED')
+        print(e)
+    return stats
+
+# cached results with one row per row of rows, or None on a miss
+def lookup(key, rows):
+    try:
+        with open(entry_path(key)) as file:
+            canonical_results = json.load(file)["results"]
+        os.utime(entry_path(key))
+    except Exception:
+        count("misses")
+        return None
+    count("hits")
+    position = {class_key : p for p, class_key in enumerate(canonical_keys(rows))}
+    return [list(canonical_results[position[request_classes.class_key(rows[str(i)])]]) for i in range(len(rows))]
+
+# keeps one result row per request class, the row of its first member
+def store(key, rows, results):
+    class_results = {}
+    for i in range(len(rows)):
+        class_results.setdefault(request_classes.class_key(rows[str(i)]), results[i])
+    try:
+        write_json(key + '.json', {"results" : [class_results[class_key] for class_key in canonical_keys(rows)]})
+        evict()
+    except Exception as e:
+        print('SOLVER CACHE WRITE FAILED')
+        print(e)
+
+def evict():
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.json') and name != stats_file]
+    entries.sort(key=os.path.getmtime)
+    for entry in entries[:max(0, len(entries) - max_entries)]:
+        os.remove(entry)
+
+def get_cache_stats():
+    stats = load_stats()
+    stats["entries"] = len([name for name in os.listdir(cache_dir) if name.endswith('.json') and name != stats_file]) if os.path.isdir(cache_dir) else 0
+    return stats
@@ -0,0 +1,110 @@
+import threading
+import time
+from array import array
+
+import cluster_cache
+import node_metrics
+
+# background sampler keeping recent node cpu and free memory in fixed-size ring buffers
+# point samples are noisy on small Jetson boards, so dispatch reads the EWMA of cpu and
+# build_data_file gets a low percentile of free memory instead of a single reading
+
+#seconds between samples
+sample_interval = 2.0
+#samples kept per node
+history_size = 300
+#smoothing factor of the exponentially weighted moving averages
+ewma_alpha = 0.3
+#quantile of recent free memory handed to the solver, low values are conservative
+memory_quantile = 0.1
+
+telemetry_lock = threading.Lock()
+node_history = {}
+started = False
+
+def new_history():
+    return {"timestamps" : array('d', [0.0]) * history_size, "cpu" : array('d', [0.0]) * history_size,
+    "memory_free" : array('d', [0.0]) * history_size, "next" : 0, "count" : 0, "cpu_ewma" : None, "memory_free_ewma" : None}
+
+def start_telemetry(custom_obj_api):
+    global started
+    with telemetry_lock:
+        if started:
+            return
+        started = True
+    threading.Thread(target=sample_loop, args=(custom_obj_api,), name='telemetry-sampler', daemon=True).start()
+
+def ewma(previous, value):
+    return value if previous is None else previous + ewma_alpha * (value - previous)
+
+def record_sample(node_name, timestamp, cpu, memory_free):
+    with telemetry_lock:
+        history = node_history.setdefault(node_name, new_history())
+        position = history["next"]
+        history["timestamps"][position] = timestamp
+        history["cpu"][position] = cpu
+        history["memory_free"][position] = memory_free
+        history["next"] = (position + 1) % history_size
+        history["count"] = min(history["count"] + 1, history_size)
+        history["cpu_ewma"] = ewma(history["cpu_ewma"], cpu)
+        history["memory_free_ewma"] = ewma(history["memory_free_ewma"], memory_free)
+
+# samples every node once: cpu in millicores, free memory in bytes (allocatable - used)
+def sample(custom_obj_api):
+    usage = node_metrics.get_snapshot(custom_obj_api)
+    now = time.time()
+    for node in cluster_cache.get_nodes():
+        name = node.metadata.name
+        if name in usage:
+            allocatable = node_metrics.parse_memory(node.status.allocatable['memory'])
+            record_sample(name, now, usage[name]['cpu'], allocatable - usage[name]['memory'])
+
+def sample_loop(custom_obj_api):
+    while True:
+        try:
+            sample(custom_obj_api)
+        except Exception as e:
+            print('TELEMETRY SAMPLE FAILED')
+            print(e)
+        time.sleep(sample_interval)
+
+# samples of one series oldest first
+def ordered(history, series, limit=None):
+    count = history["count"]
+    if limit is not None:
+        count = min(count, limit)
+    start = (history["next"] - count) % history_size
+    return [history[series][(start + offset) % history_size] for offset in range(count)]
+
+def percentile(values, quantile):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(quantile * len(values)))]
+
+# smoothed cpu (millicores) of a node for dispatch, falls back to the point sample cpu before the first sample
+def get_smoothed_cpu(node_name, cpu):
+    with telemetry_lock:
+        history = node_history.get(node_name)
+        return cpu if history is None else history["cpu_ewma"]
+
+# conservative recent free memory (bytes) of a node, None before the first sample
+def get_smoothed_free_memory(node_name):
+    with telemetry_lock:
+        history = node_history.get(node_name)
+        if history is None:
+            return None
+        return min(history["memory_free_ewma"], percentile(ordered(history, "memory_free"), memory_quantile))
+
+# recent history and smoothed values for every node, at most limit samples each
+def get_telemetry(limit=None):
+    result = {}
+    with telemetry_lock:
+        for name, history in node_history.items():
+            cpu = ordered(history, "cpu")
+            memory_free = ordered(history, "memory_free")
+            result[name] = {"timestamps" : ordered(history, "timestamps", limit), "cpu" : ordered(history, "cpu", limit),
+            "memory_free" : ordered(history, "memory_free", limit), "cpu_ewma" : history["cpu_ewma"],
+            "cpu_p50" : percentile(cpu, 0.5), "cpu_p95" : percentile(cpu, 0.95),
+            "memory_free_ewma" : history["memory_free_ewma"], "memory_free_p" + str(int(memory_quantile * 100)) : percentile(memory_free, memory_quantile)}
+    return result
@@ -0,0 +1,57 @@
+import urllib3
+
+# forwards inference calls to the chosen model endpoint over pooled keep-alive connections
+# request and response bodies are streamed through in chunks instead of being buffered
+
+#seconds to open a connection to a model endpoint
+connect_timeout = 2.0
+#seconds to wait for the model endpoint to send data
+read_timeout = 30.0
+#idle keep-alive connections kept per upstream host:port
+connections_per_upstream = 16
+#bytes read from the upstream per streamed chunk
+chunk_size = 64 * 1024
+
+#headers that describe a single connection and must not be forwarded
+hop_by_hop_headers = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailers", "transfer-encoding", "upgrade", "host", "content-length"}
+
+#one connection pool per upstream host:port
+pool_manager = urllib3.PoolManager(num_pools=64, maxsize=connections_per_upstream, block=False, retries=False)
+
+def forward_headers(headers):
+    return {name : value for name, value in headers.items() if name.lower() not in hop_by_hop_headers}
+
+# sends the request to http://<endpoint><path> and returns the unread upstream response
+# body may be bytes, a file-like stream or an iterable of chunks, content_length is needed to stream it without chunking
+def open_upstream(method, endpoint, path, headers, body, content_length=None):
+    upstream_headers = forward_headers(headers)
+    if content_length is not None:
+        upstream_headers['Content-Length'] = str(content_length)
+    return pool_manager.urlopen(method, 'http://' + endpoint + path, body=body, headers=upstream_headers,
+        preload_content=False, decode_content=False, redirect=False, retries=False,
+        timeout=urllib3.Timeout(connect=connect_timeout, read=read_timeout))
+
+# yields the upstream body and hands the connection back to its pool once it has been read
+def stream_body(upstream, on_complete=None):
+    try:
+        for chunk in upstream.stream(chunk_size, decode_content=False):
+            yield chunk
+    finally:
+        upstream.release_conn()
+        if on_complete is not None:
+            on_complete()
+
+# keeps the upstream Content-Length so fixed size responses are not re-chunked
+def response_headers(upstream):
+    headers = forward_headers(upstream.headers)
+    if 'Content-Length' in upstream.headers:
+        headers['Content-Length'] = upstream.headers['Content-Length']
+    return headers
+
+def get_pool_stats():
+    pools = {}
+    for key in list(pool_manager.pools.keys()):
+        pool = pool_manager.pools.get(key)
+        if pool is not None:
+            pools[pool.host + ':' + str(pool.port)] = {"connections_opened" : pool.num_connections, "requests" : pool.num_requests}
+    return pools